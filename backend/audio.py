@@ -0,0 +1,101 @@
+import random
+from pathlib import Path
+
+import numpy as np
+
+from .config import settings
+
+# CLAP is trained on 48kHz mono audio
+CLAP_SAMPLE_RATE = 48000
+
+# CLAP (non-fusion) embeds one 10 s window; longer input is cropped at random (rand_trunc)
+CLAP_CLIP_SECONDS = 10.0
+
+# File extension each download mode produces
+AUDIO_EXTENSIONS = {
+    "full": ".mp3",  # whole track, re-encoded to MP3
+    "sections": ".opus",  # one window, source Opus stream kept as-is
+}
+
+
+def audio_path(spotify_id: str) -> Path:
+    """Where the current download mode stores a song's audio."""
+    return settings.audio_dir / f"{spotify_id}{AUDIO_EXTENSIONS[settings.download_mode]}"
+
+
+def find_audio(spotify_id: str) -> Path | None:
+    """A song's audio file from any download mode, preferring the current one."""
+    current = audio_path(spotify_id)
+    if current.exists():
+        return current
+    for extension in AUDIO_EXTENSIONS.values():
+        path = settings.audio_dir / f"{spotify_id}{extension}"
+        if path.exists():
+            return path
+    return None
+
+
+def load_crop(file_path: str, seconds: float = CLAP_CLIP_SECONDS) -> np.ndarray | None:
+    """Decode one random `seconds` window, the crop CLAP would take from the whole track.
+
+    Only the window is decoded, so memory per song stays around 2 MB
+    however long the track is.
+    """
+    try:
+        import librosa
+        duration = librosa.get_duration(path=file_path)
+        offset = random.uniform(0.0, duration - seconds) if duration > seconds else 0.0
+        waveform, _ = librosa.load(
+            file_path, sr=CLAP_SAMPLE_RATE, mono=True, offset=offset, duration=seconds
+        )
+        return waveform.astype(np.float32)
+    except Exception as e:
+        print(f"Audio decode error for {file_path}: {e}")
+        return None
+
+
+def window_starts(duration: float, count: int, seconds: float, positions: list[float] | None = None) -> list[float]:
+    """Start times of `count` windows centred at `positions` (fractions; default evenly spaced)."""
+    if duration <= seconds:
+        return [0.0]
+    positions = positions or [(i + 1) / (count + 1) for i in range(count)]
+    return [min(max(0.0, duration * p - seconds / 2), duration - seconds) for p in positions]
+
+
+def load_windows(file_path: str, count: int, seconds: float,
+                 positions: list[float] | None = None) -> list[np.ndarray] | None:
+    """Decode only a few short windows of a file, so cost doesn't grow with track length."""
+    try:
+        import librosa
+        duration = librosa.get_duration(path=file_path)
+        windows = []
+        for start in window_starts(duration, count, seconds, positions):
+            waveform, _ = librosa.load(
+                file_path, sr=CLAP_SAMPLE_RATE, mono=True, offset=start, duration=seconds
+            )
+            windows.append(waveform.astype(np.float32))
+        return windows
+    except Exception as e:
+        print(f"Audio decode error for {file_path}: {e}")
+        return None
+
+
+def load_clips(file_path: str) -> list[np.ndarray] | None:
+    """Waveforms to embed for one file: one random crop, or sampled windows in fast mode."""
+    if settings.embed_mode == "windows":
+        return load_windows(
+            file_path,
+            settings.embed_window_count,
+            settings.embed_window_seconds,
+            settings.embed_window_positions or None,
+        )
+    waveform = load_crop(file_path)
+    return None if waveform is None else [waveform]
+
+
+def embed_mode_key() -> str:
+    """Identifies how clips are cut, for caches; empty for whole-track mode."""
+    if settings.embed_mode != "windows":
+        return ""
+    positions = ",".join(str(p) for p in settings.embed_window_positions) or "even"
+    return f"windows:{settings.embed_window_count}x{settings.embed_window_seconds}s@{positions}"
@@ -0,0 +1,184 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from .audio import CLAP_SAMPLE_RATE
+from .config import settings
+from .inference import build_backend, configure_threads
+
+
+# Vectors stored before the model was recorded came from laion-clap's default weights
+LEGACY_MODEL_KEY = "HTSAT-tiny/630k-audioset-best.pt"
+
+
+def clap_model_key() -> str:
+    """Identity of the configured weights, stored with every vector (see reconcile)."""
+    return f"{settings.clap_amodel}/{Path(settings.clap_checkpoint).name}"
+
+
+def vector_model(metadata: dict | None) -> str:
+    """The model key a stored vector was embedded with."""
+    return (metadata or {}).get("clap_model", LEGACY_MODEL_KEY)
+
+
+def resolve_checkpoint(checkpoint: str) -> str:
+    """Local path of a checkpoint: used as-is if it exists, else fetched from the Hub."""
+    if Path(checkpoint).exists():
+        return checkpoint
+
+    from huggingface_hub import hf_hub_download
+    return hf_hub_download(repo_id=settings.clap_repo, filename=checkpoint)
+
+
+def load_clap(amodel: str, checkpoint: str, backend: str = "eager"):
+    """Build a CLAP_Module from a checkpoint and wrap it in an inference backend."""
+    import laion_clap
+    model = laion_clap.CLAP_Module(enable_fusion=False, amodel=amodel)
+    model.load_ckpt(ckpt=resolve_checkpoint(checkpoint))
+    return build_backend(model, backend)
+
+
+def embed_waveforms(model, waveforms: list) -> list[list[float] | None]:
+    """CLAP audio embeddings for a batch of waveforms; None for inputs that fail."""
+    try:
+        # One forward pass for the whole batch, shape (N, 512)
+        embeddings = model.get_audio_embedding_from_data(x=waveforms, use_tensor=False)
+        return [row.tolist() for row in embeddings]
+    except Exception as e:
+        print(f"CLAP batch embedding error, retrying individually: {e}")
+
+    # Isolate the bad input so one file doesn't fail the whole batch
+    results = []
+    for waveform in waveforms:
+        try:
+            embeddings = model.get_audio_embedding_from_data(x=[waveform], use_tensor=False)
+            results.append(embeddings[0].tolist())
+        except Exception as e:
+            print(f"CLAP embedding error: {e}")
+            results.append(None)
+    return results
+
+
+def embed_clips(model, clips: list[list] | None) -> list[list[float] | None]:
+    """One vector per song from its clips: every clip in one batch, then mean-pooled.
+
+    A song with a single clip (whole-track mode) keeps its embedding as-is;
+    None for songs without clips or whose clips all fail.
+    """
+    flat = [clip for song_clips in clips if song_clips for clip in song_clips]
+    vectors = iter(embed_waveforms(model, flat) if flat else [])
+
+    pooled = []
+    for song_clips in clips:
+        song_vectors = [next(vectors) for _ in song_clips or []]
+        song_vectors = [v for v in song_vectors if v is not None]
+        if not song_vectors:
+            pooled.append(None)
+        elif len(song_vectors) == 1:
+            pooled.append(song_vectors[0])
+        else:
+            mean = np.mean(np.asarray(song_vectors, dtype=np.float32), axis=0)
+            pooled.append((mean / np.linalg.norm(mean)).tolist())
+    return pooled
+
+
+class ModelManager:
+    """Loads the CLAP model once, on a background thread, and tracks readiness.
+
+    State goes idle → loading → ready, or failed (a later start() retries).
+    Callers on the event loop await wait() instead of loading inline.
+    """
+
+    def __init__(self, checkpoint: str, amodel: str, backend: str = "eager", warmup: bool = True):
+        self.checkpoint = checkpoint
+        self.amodel = amodel
+        self.backend = backend
+        self.warmup = warmup
+        self.state = "idle"
+        self.error: str | None = None
+        self.load_seconds: float | None = None
+        self._model = None
+        self._future: Future | None = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="clap-load")
+
+    def get(self):
+        """The loaded model, or None if it isn't ready."""
+        return self._model
+
+    def set(self, model):
+        """Use an already-built model (e.g. a stub in tests or benchmarks)."""
+        self._model = model
+        self.state = "ready"
+        self._future = Future()
+        self._future.set_result(None)
+
+    def start(self) -> Future:
+        """Begin loading in the background unless a load is running or done."""
+        with self._lock:
+            if self._future is None or self.state == "failed":
+                self.state = "loading"
+                self.error = None
+                self._future = self._executor.submit(self._load)
+            return self._future
+
+    async def wait(self, timeout: float | None = None):
+        """Await the model without blocking the loop; None if it failed or timed out."""
+        if self._model is not None:
+            return self._model
+        future = asyncio.wrap_future(self.start())
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return self._model
+
+    def _load(self):
+        started = time.monotonic()
+        try:
+            print(f"Loading CLAP model ({self.amodel}, {self.checkpoint}, {self.backend})...")
+            configure_threads()
+            model = load_clap(self.amodel, self.checkpoint, self.backend)
+            if self.warmup:
+                self._warm_up(model)
+        except Exception as e:
+            print(f"Failed to load CLAP model: {e}")
+            self.state = "failed"
+            self.error = str(e)
+            return
+
+        self._model = model
+        self.load_seconds = round(time.monotonic() - started, 2)
+        self.state = "ready"
+        print(f"CLAP model ready in {self.load_seconds}s")
+
+    @staticmethod
+    def _warm_up(model):
+        """One text and one audio pass so the first real request doesn't pay for lazy init."""
+        # One prompt, like a typical search (laion-clap tokenizes it differently from a batch)
+        model.get_text_embedding(["warm up"], use_tensor=False)
+        silence = np.zeros(CLAP_SAMPLE_RATE, dtype=np.float32)
+        model.get_audio_embedding_from_data(x=[silence], use_tensor=False)
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "checkpoint": self.checkpoint,
+            "amodel": self.amodel,
+            "backend": self.backend,
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+        }
+
+
+# Shared CLAP model for embedding and search
+model_manager = ModelManager(
+    checkpoint=settings.clap_checkpoint,
+    amodel=settings.clap_amodel,
+    backend=settings.inference_backend,
+    warmup=settings.clap_warmup,
+)
@@ -7,6 +7,11 @@ class Settings(BaseSettings):
     spotify_client_id: str = ""
     spotify_client_secret: str = ""
     spotify_redirect_uri: str = "http://localhost:5173/callback"
+    spotify_concurrency: int = 4  # pages fetched in parallel during sync
+    spotify_max_retries: int = 5
+    spotify_backoff_base: float = 0.5  # seconds, when a 429 has no Retry-After
+    spotify_backoff_max: float = 30.0
+    sync_ingest_batch: int = 500  # tracks per bulk upsert
 
     # Paths
     base_dir: Path = Path(__file__).parent.parent
@@ -15,11 +20,72 @@ class Settings(BaseSettings):
     library_path: Path = data_dir / "library.json"
     chroma_dir: Path = data_dir / "chroma"
 
+    # SQLite
+    db_threads: int = 4
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_cache_kb: int = 20000
+
+    # Job queue
+    job_page_size: int = 50  # most jobs claimed from SQLite at a time
+    job_lease_seconds: int = 900
+    job_max_attempts: int = 3
+    job_retry_base_seconds: float = 30  # doubles on each retry
+    write_batch_size: int = 256  # buffered status/vector writes that trigger a flush
+    write_flush_seconds: float = 0.5  # longest a write waits in the buffer
+
     # CLAP
-    clap_checkpoint: str = "music_speech_audioset_epoch_15_esc_89.98.pt"
+    # Changing the model re-embeds the library (see PLAN.md); the music
+    # checkpoint is music_speech_audioset_epoch_15_esc_89.98.pt with HTSAT-base
+    clap_checkpoint: str = "630k-audioset-best.pt"  # local path or file in clap_repo
+    clap_repo: str = "lukewys/laion_clap"
+    clap_amodel: str = "HTSAT-tiny"  # audio encoder the checkpoint was trained with
+    clap_load_on_startup: bool = True
+    clap_warmup: bool = True
+    model_wait_timeout: float = 30  # seconds a search waits for the model before a 503
+    inference_backend: str = "eager"  # eager | int8 | torchscript | onnx
+    inference_threads: int = 0  # intra-op threads; 0 keeps the runtime default
+    inference_interop_threads: int = 0
+
+    # Embed
+    embed_batch_size: int = 8
+    embed_decode_workers: int = 2
+    embed_workers: int = 1  # >1 embeds in that many processes, each with its own model copy
+    embed_worker_threads: int = 0  # threads per worker process; 0 splits the cores evenly
+    embedding_dim: int = 512
+    embedding_cache: bool = True  # reuse vectors for files whose content was embedded before
+    embed_mode: str = "full"  # full (one random 10 s crop, as CLAP takes) | windows (sampled windows, mean-pooled)
+    embed_window_count: int = 3
+    embed_window_seconds: float = 10  # CLAP's own input length
+    embed_window_positions: list[float] = []  # window centres as track fractions; empty = evenly spaced
+    pipeline_queue_size: int = 32  # downloaded songs allowed to wait for the embedder
+
+    # Search
+    search_backend: str = "numpy"  # numpy (in-memory exact) | chroma
+    search_batch_max: int = 64  # queries per /search/batch call (each may need a text encode)
+    text_cache_size: int = 1024
+    text_cache_persist: bool = True
+    text_cache_disk_size: int = 100_000  # queries kept in text_cache.db (least recently used dropped)
+
+    # Progress events
+    event_history: int = 512  # events kept per topic for Last-Event-ID replay
+    event_buffer: int = 64  # queued events per client before progress is coalesced
 
     # Download
-    max_concurrent_downloads: int = 4
+    download_mode: str = "full"  # full (whole track, MP3) | sections (one window, Opus)
+    download_section_seconds: float = 30  # sections mode: window length
+    download_section_center: float = 0.5  # sections mode: window centre as a fraction of the track
+    max_concurrent_downloads: int = 4  # starting limit; adapts within the bounds below
+    download_min_concurrency: int = 1
+    download_max_concurrency: int = 12
+    download_congestion_threshold: float = 0.2  # share of timeouts/429s in a window that halves the limit
+    download_timeout: float = 120  # seconds per song
+
+    # Profiling (opt-in)
+    profiling_enabled: bool = False  # allows ?profile=1 / X-Profile requests and /api/profile
+    profile_interval_ms: float = 5  # sampling period
+    profile_max_seconds: float = 300  # longest whole-process profile
+    profile_slow_requests: int = 0  # keep profiles of the N slowest requests; 0 = off
+    profile_history_seconds: float = 60  # samples kept for slow-request capture
 
     class Config:
         env_file = ".env"
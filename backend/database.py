@@ -1,24 +1,57 @@
-from sqlmodel import SQLModel, create_engine, Session
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 
+from sqlalchemy import event
+from sqlmodel import SQLModel, create_engine, Session
+
 from .config import settings
-from .models import Song  # Import to register table
+from .metrics import sqlite_session_seconds
+from .models import Job, Song, SyncSource  # Import to register tables
 
 # SQLite database URL
 DATABASE_URL = f"sqlite:///{settings.data_dir}/songs.db"
 
-# Create engine
-engine = create_engine(DATABASE_URL, echo=False)
+# Create engine; connections are shared with the db thread pool below
+engine = create_engine(
+    DATABASE_URL,
+    echo=False,
+    connect_args={
+        "check_same_thread": False,
+        "timeout": settings.sqlite_busy_timeout_ms / 1000,
+    },
+)
+
+# Blocking database work runs here instead of on the event loop
+_executor = ThreadPoolExecutor(max_workers=settings.db_threads, thread_name_prefix="db")
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL lets readers proceed while a writer commits; NORMAL sync is safe under WAL."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={settings.sqlite_busy_timeout_ms}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute(f"PRAGMA cache_size=-{settings.sqlite_cache_kb}")
+    cursor.close()
 
 
 def init_db():
-    """Create all tables."""
+    """Create all tables and any indexes missing from an existing database."""
     SQLModel.metadata.create_all(engine)
+    # create_all skips indexes on tables that already exist
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
 
 
 @contextmanager
 def get_session():
     """Get a database session."""
+    started = time.perf_counter()
     session = Session(engine)
     try:
         yield session
@@ -28,3 +61,10 @@ def get_session():
         raise
     finally:
         session.close()
+        sqlite_session_seconds.observe(time.perf_counter() - started)
+
+
+async def run_db(fn, *args):
+    """Run a blocking database function on the db thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, fn, *args)
@@ -0,0 +1,240 @@
+import asyncio
+import multiprocessing
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _worker_main(conn, params: dict):
+    """Worker process: one long-lived YoutubeDL serving jobs from a pipe.
+
+    Reusing the instance keeps extractors imported and the HTTP connection
+    pool warm between songs.
+    """
+    from yt_dlp import YoutubeDL
+
+    with YoutubeDL(params) as ydl:
+        while True:
+            try:
+                job = conn.recv()
+            except EOFError:
+                break
+            if job is None:
+                break
+
+            query, outtmpl = job
+            try:
+                ydl.params["outtmpl"] = {"default": outtmpl}
+                retcode = ydl.download([query])
+                conn.send((retcode == 0, None))
+            except Exception as e:
+                conn.send((False, str(e)))
+
+
+def middle_section(info: dict, ydl, seconds: float, center: float = 0.5):
+    """yt-dlp download_ranges callback: one `seconds`-long window centred at `center`."""
+    duration = info.get("duration")
+    if not duration or duration <= seconds:
+        yield {"start_time": 0, "end_time": duration or seconds}
+        return
+    start = min(max(0.0, duration * center - seconds / 2), duration - seconds)
+    yield {"start_time": start, "end_time": start + seconds}
+
+
+class _Worker:
+    def __init__(self, ctx, target, params: dict):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=target, args=(child_conn, params), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def request(self, job, timeout: float):
+        """Send a job and block until its result (runs on a waiter thread)."""
+        self.conn.send(job)
+        if not self.conn.poll(timeout):
+            raise TimeoutError
+        return self.conn.recv()
+
+    def ask_to_stop(self):
+        """Tell the worker to exit once its current job is done."""
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class DownloadPool:
+    """Small pool of long-lived yt-dlp worker processes fed one job at a time.
+
+    Workers are started on demand, up to `size`. A worker that hits the
+    per-song timeout or dies is killed and replaced, so one stuck download
+    never shrinks the pool.
+    """
+
+    def __init__(self, size: int, params: dict, target=_worker_main):
+        self.size = size
+        self.params = params
+        self.target = target
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle: asyncio.Queue | None = None
+        self._workers: list[_Worker] = []
+        # One thread per worker to wait on its pipe
+        self._waiters = ThreadPoolExecutor(max_workers=size, thread_name_prefix="yt-dlp")
+
+    def _spawn(self) -> _Worker:
+        worker = _Worker(self._ctx, self.target, self.params)
+        self._workers.append(worker)
+        return worker
+
+    def _replace(self, worker: _Worker) -> _Worker | None:
+        """Kill a worker and start another in its place; None once the pool is closed."""
+        worker.kill()
+        if worker not in self._workers:
+            return None
+        self._workers.remove(worker)
+        return self._spawn()
+
+    async def run(self, query: str, outtmpl: str, timeout: float) -> tuple[bool, str | None]:
+        """Download one query; raises asyncio.TimeoutError after `timeout` seconds."""
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+
+        if self._idle.empty() and len(self._workers) < self.size:
+            worker = self._spawn()
+        else:
+            worker = await self._idle.get()
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self._waiters, worker.request, (query, outtmpl), timeout
+            )
+        except TimeoutError:
+            worker = self._replace(worker)
+            raise asyncio.TimeoutError
+        except (EOFError, BrokenPipeError, OSError) as e:
+            worker = self._replace(worker)
+            return False, f"worker died: {e}"
+        except asyncio.CancelledError:
+            # The worker is still busy with the abandoned song: kill it and start
+            # another. Its pipe is left to the waiter thread, which sees EOF;
+            # closing it here could hand the fd to the new worker under that thread.
+            worker.process.kill()
+            if worker in self._workers:
+                self._workers.remove(worker)
+                worker = self._spawn()
+            else:
+                worker = None
+            raise
+        finally:
+            # A download still running when the pool closed has nothing to return
+            if worker is not None and worker in self._workers:
+                self._idle.put_nowait(worker)
+
+    def close(self, timeout: float = 5):
+        """Stop all workers: ask them all first, then wait up to `timeout` in total and kill the rest."""
+        for worker in self._workers:
+            worker.ask_to_stop()
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.process.join(max(0.0, deadline - time.monotonic()))
+            worker.kill()
+        self._workers.clear()
+        self._idle = None
+        self._waiters.shutdown(wait=False)
+
+
+# yt-dlp errors that mean "back off" rather than "this song is unavailable"
+_CONGESTION = re.compile(r"429|too many requests|rate.?limit|timed? ?out|worker died", re.IGNORECASE)
+
+
+def is_congestion(error: str | None) -> bool:
+    return bool(error) and _CONGESTION.search(error) is not None
+
+
+class AdaptiveLimiter:
+    """AIMD limit on in-flight downloads.
+
+    Outcomes are judged in windows of `limit` completed downloads. A window
+    with too many timeouts or rate-limit errors halves the limit; a clean
+    window raises it by one, unless the last raise bought no throughput, in
+    which case the limit steps back by one (the pipe is already full).
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, congestion_threshold: float = 0.2):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.congestion_threshold = congestion_threshold
+        self.in_flight = 0
+        self._cond = asyncio.Condition()
+
+        self.latency = None  # EWMA seconds per successful download
+        self.throughput = 0.0  # successful downloads per second, last window
+        self._last_throughput = 0.0
+        self._raised = False
+        self._reset_window()
+
+    def _reset_window(self):
+        self._window_start = time.monotonic()
+        self._completed = 0
+        self._succeeded = 0
+        self._congested = 0
+
+    async def acquire(self, n: int) -> int:
+        """Take up to `n` free slots, waiting for at least one; returns how many were taken."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            taken = min(n, self.limit - self.in_flight)
+            self.in_flight += taken
+            return taken
+
+    async def release(self, n: int = 1):
+        async with self._cond:
+            self.in_flight -= n
+            self._cond.notify_all()
+
+    def record(self, latency: float, ok: bool, congested: bool = False):
+        """Feed back one finished download; may move the limit."""
+        self._completed += 1
+        if ok:
+            self._succeeded += 1
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        if congested:
+            self._congested += 1
+
+        if self._completed >= self.limit:
+            self._adjust()
+
+    def _adjust(self):
+        elapsed = max(time.monotonic() - self._window_start, 1e-6)
+        self.throughput = self._succeeded / elapsed
+
+        if self._congested / self._completed > self.congestion_threshold:
+            # Multiplicative decrease
+            self.limit = max(self.minimum, self.limit // 2)
+            self._raised = False
+        elif self._raised and self.throughput < self._last_throughput:
+            # The extra slot didn't help: give it back and hold
+            self.limit = max(self.minimum, self.limit - 1)
+            self._raised = False
+        else:
+            # Additive increase
+            self._raised = self.limit < self.maximum
+            self.limit = min(self.maximum, self.limit + 1)
+
+        self._last_throughput = self.throughput
+        self._reset_window()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "latency": round(self.latency, 2) if self.latency is not None else None,
+            "throughput": round(self.throughput, 3),
+        }
@@ -0,0 +1,61 @@
+"""Process-pool CLAP workers for CPU-only hosts.
+
+Each worker loads its own copy of the model once and keeps its math
+libraries to a fixed number of threads (and, where supported, its own
+CPU cores), so N workers scale across cores instead of contending for
+one interpreter. Batches of file paths arrive through the executor's
+shared call queue; vectors go back to the parent, which stores them.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from .audio import load_clips
+from .clap import embed_clips, load_clap
+from .config import settings
+
+# The worker's model, loaded by _init_worker
+_model = None
+
+
+def _pin(index: int, threads: int):
+    """Limit this process to `threads` math threads on its own slice of cores."""
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+
+    if hasattr(os, "sched_setaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+        start = (index * threads) % len(cpus)
+        os.sched_setaffinity(0, {cpus[(start + i) % len(cpus)] for i in range(threads)})
+
+
+def _init_worker(counter, threads: int):
+    global _model
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    _pin(index, threads)
+
+    import torch
+    torch.set_num_threads(threads)
+
+    _model = load_clap(settings.clap_amodel, settings.clap_checkpoint, settings.inference_backend)
+    print(f"Embed worker {index} ready (pid {os.getpid()}, {threads} threads)")
+
+
+def embed_files(paths: list[str]) -> list[list[float] | None]:
+    """Decode and embed a batch of files in the worker; None for files that fail."""
+    return embed_clips(_model, [load_clips(path) for path in paths])
+
+
+def make_pool(workers: int, threads: int = 0) -> ProcessPoolExecutor:
+    """Start `workers` embedding processes; `threads` per worker defaults to an even share of cores."""
+    threads = threads or max(1, (os.cpu_count() or 1) // workers)
+    ctx = multiprocessing.get_context("spawn")
+    counter = ctx.Value("i", 0)
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=ctx,
+        initializer=_init_worker,
+        initargs=(counter, threads),
+    )
@@ -0,0 +1,98 @@
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from .audio import embed_mode_key
+from .config import settings
+
+
+def file_digest(file_path: str) -> str | None:
+    """blake2b of a file's bytes; None if it can't be read."""
+    digest = hashlib.blake2b(digest_size=20)
+    try:
+        with open(file_path, "rb") as f:
+            while chunk := f.read(1 << 20):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """CLAP audio embeddings keyed by file content hash, persisted in SQLite.
+
+    Keys also carry the model identity (checkpoint, backend) and how clips
+    are cut, so a model or mode change never serves mismatched vectors.
+    Identical audio under two Spotify ids, or a file embedded before a Chroma
+    rebuild, costs one lookup instead of a forward pass.
+    """
+
+    def __init__(self, path: Path, model_key: str):
+        self.model_key = model_key
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS audio_embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._db.commit()
+
+    def _key(self, digest: str) -> str:
+        return f"{self.model_key}\x00{digest}"
+
+    def get_many(self, digests: list[str]) -> dict[str, list[float]]:
+        """Cached vectors for the given content digests (missing ones are left out)."""
+        digests = list(dict.fromkeys(digests))
+        if not digests:
+            return {}
+        keys = {self._key(digest): digest for digest in digests}
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT key, vector FROM audio_embeddings WHERE key IN ({','.join('?' * len(keys))})",
+                list(keys),
+            ).fetchall()
+            found = {keys[key]: np.frombuffer(vector, dtype=np.float32).tolist() for key, vector in rows}
+            self.hits += len(found)
+            self.misses += len(digests) - len(found)
+        return found
+
+    def put_many(self, vectors: dict[str, list[float]]):
+        """Store vectors by content digest in one transaction."""
+        if not vectors:
+            return
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO audio_embeddings (key, vector) VALUES (?, ?)",
+                [
+                    (self._key(digest), np.asarray(vector, dtype=np.float32).tobytes())
+                    for digest, vector in vectors.items()
+                ],
+            )
+            self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._db.execute("SELECT COUNT(*) FROM audio_embeddings").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "size": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Shared cache for the embed runner (None when disabled)
+embedding_cache = EmbeddingCache(
+    path=settings.data_dir / "embedding_cache.db",
+    model_key="+".join(filter(None, [
+        settings.clap_checkpoint,
+        settings.inference_backend if settings.inference_backend != "eager" else "",
+        embed_mode_key(),
+    ])),
+) if settings.embedding_cache else None
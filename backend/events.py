@@ -0,0 +1,156 @@
+import asyncio
+import json
+from collections import deque
+from dataclasses import dataclass
+from itertools import count
+
+from sse_starlette.sse import EventSourceResponse
+
+from .config import settings
+
+# Events that end a run; never coalesced, and they close the SSE stream
+TERMINAL = {"complete", "error"}
+
+
+@dataclass
+class Event:
+    id: int
+    topic: str
+    event: str
+    data: dict
+
+    def sse(self) -> dict:
+        return {"id": str(self.id), "event": self.event, "data": json.dumps(self.data)}
+
+
+class Subscription:
+    """One client's queue of events from one or more topics.
+
+    A client that falls more than `buffer` events behind gets its queue
+    coalesced per (topic, event): only the newest progress of each topic
+    is kept, so a slow dashboard sees fewer updates instead of an
+    ever-growing backlog, even when several topics interleave. Terminal
+    events are always kept.
+    """
+
+    def __init__(self, bus: "EventBus", topics: tuple[str, ...], buffer: int):
+        self._bus = bus
+        self.topics = topics
+        self.buffer = buffer
+        self._queue: deque[Event] = deque()
+        self._ready = asyncio.Event()
+
+    def push(self, event: Event):
+        self._queue.append(event)
+        if len(self._queue) > self.buffer and event.event not in TERMINAL:
+            self._coalesce()
+        self._ready.set()
+
+    def _coalesce(self):
+        """Keep terminal events and the newest queued event of every other (topic, event)."""
+        seen = set()
+        kept = []
+        for queued in reversed(self._queue):
+            key = (queued.topic, queued.event)
+            if queued.event in TERMINAL or key not in seen:
+                seen.add(key)
+                kept.append(queued)
+        self._queue = deque(reversed(kept))
+
+    async def get(self) -> Event:
+        while not self._queue:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._queue.popleft()
+
+    def close(self):
+        self._bus._unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class EventBus:
+    """In-process pub/sub for progress events, one topic per stage.
+
+    Event ids increase across all topics, and each topic keeps a ring buffer
+    of recent events so a reconnecting client can resume from Last-Event-ID.
+    Publish from the event loop only.
+    """
+
+    def __init__(self, history: int = 512, buffer: int = 64):
+        self.history = history
+        self.buffer = buffer
+        self._ids = count(1)
+        self._history: dict[str, deque[Event]] = {}
+        self._subscribers: dict[str, set[Subscription]] = {}
+
+    def publish(self, topic: str, event: str, data: dict) -> Event:
+        item = Event(next(self._ids), topic, event, data)
+        history = self._history.setdefault(topic, deque(maxlen=self.history))
+        history.append(item)
+        for subscription in self._subscribers.get(topic, ()):
+            subscription.push(item)
+        return item
+
+    def latest(self, topic: str, event: str | None = None) -> Event | None:
+        """Newest event on a topic, optionally of one type."""
+        for item in reversed(self._history.get(topic, ())):
+            if event is None or item.event == event:
+                return item
+        return None
+
+    def subscribe(self, *topics: str, last_event_id: int | None = None) -> Subscription:
+        """Subscribe to topics, pre-loaded with what the client has not seen yet.
+
+        With a Last-Event-ID that's everything after it still in the ring
+        buffer; without one, the newest event per topic, so a fresh client
+        starts from the current state.
+        """
+        subscription = Subscription(self, topics, self.buffer)
+        if last_event_id is None:
+            backlog = [event for topic in topics if (event := self.latest(topic)) is not None]
+        else:
+            backlog = [
+                event
+                for topic in topics
+                for event in self._history.get(topic, ())
+                if event.id > last_event_id
+            ]
+        # Replay is queued in full; live events coalesce with it if the client falls behind
+        subscription._queue.extend(sorted(backlog, key=lambda event: event.id))
+
+        for topic in topics:
+            self._subscribers.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription: Subscription):
+        for topic in subscription.topics:
+            self._subscribers.get(topic, set()).discard(subscription)
+
+
+def parse_last_event_id(value: str | None) -> int | None:
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def stream(topic: str, last_event_id: str | None = None) -> EventSourceResponse:
+    """SSE response relaying one topic until its run completes or fails."""
+    async def event_generator():
+        with bus.subscribe(topic, last_event_id=parse_last_event_id(last_event_id)) as subscription:
+            while True:
+                event = await subscription.get()
+                yield event.sse()
+                if event.event in TERMINAL:
+                    break
+
+    return EventSourceResponse(event_generator())
+
+
+# Shared bus for sync, download, embed and pipeline progress
+bus = EventBus(history=settings.event_history, buffer=settings.event_buffer)
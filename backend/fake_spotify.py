@@ -0,0 +1,115 @@
+"""Local stand-in for the Spotify Web API, for tests and offline runs.
+
+Mount it on the shared HTTP session and the real spotipy client talks to it:
+
+    from backend import spotify
+    from backend.fake_spotify import FakeSpotify
+
+    fake = FakeSpotify()
+    fake.add_playlist("p1", fake.make_tracks(120))
+    spotify._http.mount("https://api.spotify.com/", fake)
+"""
+import json
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Callable
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from requests.adapters import BaseAdapter
+
+
+class FakeSpotify(BaseAdapter):
+    """requests transport adapter that answers the endpoints sync uses."""
+
+    def __init__(self):
+        super().__init__()
+        self.playlists: dict[str, dict] = {}
+        self.liked: list[dict] = []  # newest first, like the real API
+        self.calls: Counter = Counter()
+        # (path, query params) → seconds to wait before answering, e.g. to
+        # make concurrently fetched pages complete out of order
+        self.latency: Callable[[str, dict], float] | None = None
+        self._lock = threading.Lock()
+        self._throttle: list[float] = []
+
+    # ---- fixtures ----
+
+    @staticmethod
+    def make_tracks(count: int, start: int = 0, newest: datetime | None = None) -> list[dict]:
+        """Track items one minute apart, newest first."""
+        newest = newest or datetime(2024, 1, 1)
+        return [
+            {
+                "added_at": (newest - timedelta(minutes=i)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "track": {
+                    "id": f"track{start + i:06d}",
+                    "name": f"Song {start + i}",
+                    "artists": [{"name": f"Artist {(start + i) % 50}"}],
+                    "album": {"name": f"Album {(start + i) % 200}", "images": [{"url": "https://i.example/a.jpg"}]},
+                    "uri": f"spotify:track:track{start + i:06d}",
+                },
+            }
+            for i in range(count)
+        ]
+
+    def add_playlist(self, playlist_id: str, items: list[dict], snapshot_id: str = "snap1"):
+        self.playlists[playlist_id] = {"items": list(items), "snapshot_id": snapshot_id}
+
+    def throttle(self, *retry_after: float):
+        """Answer the next len(retry_after) requests with 429 and these Retry-After values."""
+        self._throttle.extend(retry_after)
+
+    # ---- transport ----
+
+    def send(self, request, **kwargs):
+        url = urlparse(request.url)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        parts = url.path.removeprefix("/v1/").strip("/").split("/")
+
+        with self._lock:
+            self.calls[url.path] += 1
+            if self._throttle:
+                return self._respond(request, 429, {"error": {"status": 429, "message": "rate limited"}},
+                                     {"Retry-After": str(self._throttle.pop(0))})
+
+        if self.latency is not None:
+            time.sleep(self.latency(url.path, params))
+
+        if parts[:2] == ["me", "tracks"]:
+            return self._respond(request, 200, self._page(self.liked, params))
+
+        if parts[0] == "playlists" and len(parts) >= 2 and parts[1] in self.playlists:
+            playlist = self.playlists[parts[1]]
+            if len(parts) == 2:
+                return self._respond(request, 200, {
+                    "name": parts[1],
+                    "snapshot_id": playlist["snapshot_id"],
+                    "tracks": {"total": len(playlist["items"])},
+                })
+            if parts[2] in ("tracks", "items"):
+                return self._respond(request, 200, self._page(playlist["items"], params))
+
+        return self._respond(request, 404, {"error": {"status": 404, "message": "not found"}})
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _page(items: list[dict], params: dict) -> dict:
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", 20))
+        return {"items": items[offset:offset + limit], "total": len(items), "offset": offset, "limit": limit}
+
+    @staticmethod
+    def _respond(request, status: int, body: dict, headers: dict | None = None) -> requests.Response:
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(body).encode()
+        response.headers.update({"Content-Type": "application/json", **(headers or {})})
+        response.url = request.url
+        response.request = request
+        response.encoding = "utf-8"
+        return response
@@ -0,0 +1,204 @@
+import threading
+
+import numpy as np
+
+from .clap import clap_model_key, vector_model
+from .config import settings
+from .db import collection
+
+# Rows fetched per page when loading the index from ChromaDB
+_LOAD_PAGE_SIZE = 1000
+
+
+def _normalize(vectors) -> np.ndarray:
+    """Return vectors as a contiguous, L2-normalized float32 matrix."""
+    matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[np.newaxis, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class NumpyIndex:
+    """Exact cosine search over an in-memory, L2-normalized float32 matrix.
+
+    ChromaDB stays the persistent source of truth; this index is rebuilt
+    from it on first use and kept current by `add()` as embeddings are stored.
+    """
+
+    def __init__(self, dim: int = 512):
+        self._lock = threading.Lock()
+        self._matrix = np.empty((0, dim), dtype=np.float32)
+        self._size = 0
+        self._ids: list[str] = []
+        self._metadatas: list[dict] = []
+        self._rows: dict[str, int] = {}
+
+    def count(self) -> int:
+        return self._size
+
+    def load(self):
+        """Populate the index from the ChromaDB collection in pages.
+
+        Vectors from another CLAP model are left out: they can't be compared
+        with this model's text embeddings (their songs are re-embedded).
+        """
+        current = clap_model_key()
+        offset = 0
+        while True:
+            page = collection.get(
+                limit=_LOAD_PAGE_SIZE,
+                offset=offset,
+                include=["embeddings", "metadatas"]
+            )
+            if not page["ids"]:
+                break
+            keep = [i for i, metadata in enumerate(page["metadatas"]) if vector_model(metadata) == current]
+            if keep:
+                self.add(
+                    [page["ids"][i] for i in keep],
+                    [page["embeddings"][i] for i in keep],
+                    [page["metadatas"][i] for i in keep],
+                )
+            offset += len(page["ids"])
+
+    def add(self, ids: list[str], embeddings, metadatas: list[dict]):
+        """Append new vectors and replace existing ones in place."""
+        vectors = _normalize(embeddings)
+
+        with self._lock:
+            new = [i for i, spotify_id in enumerate(ids) if spotify_id not in self._rows]
+            self._reserve(self._size + len(new))
+
+            for i, spotify_id in enumerate(ids):
+                row = self._rows.get(spotify_id)
+                if row is None:
+                    row = self._size
+                    self._rows[spotify_id] = row
+                    self._ids.append(spotify_id)
+                    self._metadatas.append(metadatas[i])
+                    self._size += 1
+                else:
+                    self._metadatas[row] = metadatas[i]
+                self._matrix[row] = vectors[i]
+
+    def remove(self, ids: list[str]):
+        """Drop vectors by id, moving the last row into each freed slot."""
+        with self._lock:
+            for spotify_id in ids:
+                row = self._rows.pop(spotify_id, None)
+                if row is None:
+                    continue
+                last = self._size - 1
+                if row != last:
+                    moved_id = self._ids[last]
+                    self._matrix[row] = self._matrix[last]
+                    self._ids[row] = moved_id
+                    self._metadatas[row] = self._metadatas[last]
+                    self._rows[moved_id] = row
+                self._ids.pop()
+                self._metadatas.pop()
+                self._size -= 1
+
+    def query(self, query_vectors, n_results: int) -> list[list[tuple[str, float, dict]]]:
+        """Return the top-k (id, similarity, metadata) hits for each query vector."""
+        queries = _normalize(query_vectors)
+
+        with self._lock:
+            size = self._size
+            k = min(n_results, size)
+            if k <= 0:
+                return [[] for _ in range(len(queries))]
+
+            # Cosine similarity for every (query, song) pair in one matmul
+            scores = queries @ self._matrix[:size].T
+
+            if k < size:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(np.arange(size), (len(queries), size))
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+            return [
+                [
+                    (self._ids[row], float(score), self._metadatas[row])
+                    for row, score in zip(rows, row_scores)
+                ]
+                for rows, row_scores in zip(top, top_scores)
+            ]
+
+    def _reserve(self, capacity: int):
+        """Grow the backing matrix geometrically so appends stay amortized O(1)."""
+        if capacity <= len(self._matrix):
+            return
+        new_capacity = max(capacity, 2 * len(self._matrix), 64)
+        matrix = np.empty((new_capacity, self._matrix.shape[1]), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        self._matrix = matrix
+
+
+class ChromaIndex:
+    """Search straight against the persistent ChromaDB collection."""
+
+    def count(self) -> int:
+        return collection.count()
+
+    def load(self):
+        pass
+
+    def add(self, ids: list[str], embeddings, metadatas: list[dict]):
+        # The caller already upserted into ChromaDB
+        pass
+
+    def remove(self, ids: list[str]):
+        pass
+
+    def query(self, query_vectors, n_results: int) -> list[list[tuple[str, float, dict]]]:
+        count = collection.count()
+        if count == 0:
+            return [[] for _ in range(len(query_vectors))]
+
+        # Only vectors from the configured model (reconcile tags untagged ones)
+        results = collection.query(
+            query_embeddings=[list(map(float, v)) for v in query_vectors],
+            n_results=min(n_results, count),
+            where={"clap_model": clap_model_key()},
+            include=["metadatas", "distances"]
+        )
+
+        # ChromaDB returns cosine distance, convert to similarity
+        return [
+            [
+                (spotify_id, 1 - distance, metadata)
+                for spotify_id, distance, metadata in zip(ids, distances, metadatas)
+            ]
+            for ids, distances, metadatas in zip(
+                results["ids"], results["distances"], results["metadatas"]
+            )
+        ]
+
+
+_BACKENDS = {
+    "numpy": lambda: NumpyIndex(dim=settings.embedding_dim),
+    "chroma": ChromaIndex,
+}
+
+_state = {"index": None}
+_load_lock = threading.Lock()
+
+
+def get_index():
+    """Get the configured search backend, loading it on first use."""
+    if _state["index"] is None:
+        with _load_lock:
+            if _state["index"] is None:
+                if settings.search_backend not in _BACKENDS:
+                    raise ValueError(f"Unknown search backend: {settings.search_backend}")
+                index = _BACKENDS[settings.search_backend]()
+                index.load()
+                _state["index"] = index
+    return _state["index"]
@@ -0,0 +1,340 @@
+"""CPU inference backends for CLAP.
+
+Every backend exposes the two CLAP_Module methods the app uses,
+get_audio_embedding_from_data and get_text_embedding, so embed and search
+don't care which one is active:
+
+    eager        laion-clap as shipped (fp32 PyTorch)
+    int8         dynamic int8 quantization of the Linear layers
+    torchscript  traced audio/text encoders
+    onnx         the same encoders exported to ONNX Runtime
+
+Parity check against the fp32 model:
+
+    python -m backend.inference --backend int8 --samples 32
+"""
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from .config import settings
+
+BACKENDS = ("eager", "int8", "torchscript", "onnx")
+
+# CLAP (non-fusion) encodes 10 s windows at 48 kHz
+_AUDIO_SAMPLES = 480000
+
+
+def configure_threads():
+    """Apply the configured intra-/inter-op thread counts (0 keeps PyTorch's default)."""
+    if not settings.inference_threads and not settings.inference_interop_threads:
+        return
+    import torch
+    if settings.inference_threads:
+        torch.set_num_threads(settings.inference_threads)
+    if settings.inference_interop_threads:
+        try:
+            torch.set_num_interop_threads(settings.inference_interop_threads)
+        except RuntimeError:
+            # Only allowed before the first parallel op
+            pass
+
+
+def build_backend(model, name: str):
+    """Wrap a loaded CLAP_Module in the named backend; falls back to eager on failure."""
+    if name not in BACKENDS:
+        print(f"Unknown inference backend {name!r}, using eager")
+        return model
+    if name == "eager":
+        return model
+
+    try:
+        if name == "int8":
+            return _quantize(model)
+        if name == "torchscript":
+            return GraphModel(model, _TorchScriptRunner(model))
+        return GraphModel(model, _OnnxRunner(model))
+    except Exception as e:
+        print(f"Failed to build {name} backend, using eager: {e}")
+        return model
+
+
+def _quantize(model):
+    """Swap every nn.Linear for a dynamically quantized int8 one, in place."""
+    import torch
+    model.model.eval()
+    model.model = torch.quantization.quantize_dynamic(
+        model.model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+    return model
+
+
+def _encoders(model):
+    """nn.Modules mapping prepared tensors to normalized CLAP embeddings."""
+    import torch
+    import torch.nn.functional as F
+
+    clap = model.model.eval()
+
+    class AudioEncoder(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.clap = clap
+
+        def forward(self, waveform):
+            embedding = self.clap.audio_branch(
+                {"waveform": waveform}, mixup_lambda=None, device=waveform.device
+            )["embedding"]
+            return F.normalize(self.clap.audio_projection(embedding), dim=-1)
+
+    class TextEncoder(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.clap = clap
+
+        def forward(self, input_ids, attention_mask):
+            pooled = self.clap.text_branch(
+                input_ids=input_ids, attention_mask=attention_mask
+            )["pooler_output"]
+            return F.normalize(self.clap.text_projection(pooled), dim=-1)
+
+    return AudioEncoder().eval(), TextEncoder().eval()
+
+
+def _tokenize(model, texts: list[str]):
+    """input_ids and attention_mask as (N, 77) tensors.
+
+    laion-clap's tokenizer squeezes a single text down to 1-D (its own
+    get_text_embedding adds the batch axis back), so restore it here.
+    """
+    tokens = model.tokenizer(list(texts))
+    return (
+        tokens["input_ids"].reshape(len(texts), -1),
+        tokens["attention_mask"].reshape(len(texts), -1),
+    )
+
+
+def _example_inputs(model, batch: int):
+    import torch
+    waveform = torch.zeros(batch, _AUDIO_SAMPLES)
+    input_ids, attention_mask = _tokenize(model, ["example"] * batch)
+    return waveform, input_ids, attention_mask
+
+
+class _TorchScriptRunner:
+    """Traced encoders. Tracing bakes in the batch size, so inputs are padded to it."""
+
+    def __init__(self, model):
+        import torch
+        self.batch = settings.embed_batch_size
+        audio, text = _encoders(model)
+        waveform, input_ids, attention_mask = _example_inputs(model, self.batch)
+        with torch.inference_mode():
+            self._audio = torch.jit.freeze(torch.jit.trace(audio, (waveform,), check_trace=False))
+            self._text = torch.jit.freeze(
+                torch.jit.trace(text, (input_ids, attention_mask), check_trace=False)
+            )
+
+    def audio(self, waveform: np.ndarray) -> np.ndarray:
+        import torch
+        with torch.inference_mode():
+            return self._audio(torch.from_numpy(waveform)).numpy()
+
+    def text(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        import torch
+        with torch.inference_mode():
+            return self._text(torch.from_numpy(input_ids), torch.from_numpy(attention_mask)).numpy()
+
+
+class _OnnxRunner:
+    """Encoders exported once to data_dir/onnx and run on ONNX Runtime."""
+
+    def __init__(self, model):
+        import onnxruntime as ort
+
+        self.batch = settings.embed_batch_size
+        export_dir = settings.data_dir / "onnx"
+        export_dir.mkdir(exist_ok=True)
+        stem = f"{Path(settings.clap_checkpoint).stem}-b{self.batch}"
+        audio_path = export_dir / f"{stem}-audio.onnx"
+        text_path = export_dir / f"{stem}-text.onnx"
+        if not audio_path.exists() or not text_path.exists():
+            self._export(model, audio_path, text_path)
+
+        options = ort.SessionOptions()
+        if settings.inference_threads:
+            options.intra_op_num_threads = settings.inference_threads
+        if settings.inference_interop_threads:
+            options.inter_op_num_threads = settings.inference_interop_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        providers = ["CPUExecutionProvider"]
+        self._audio = ort.InferenceSession(str(audio_path), options, providers=providers)
+        self._text = ort.InferenceSession(str(text_path), options, providers=providers)
+
+    def _export(self, model, audio_path: Path, text_path: Path):
+        import torch
+        print(f"Exporting CLAP encoders to {audio_path.parent}...")
+        audio, text = _encoders(model)
+        waveform, input_ids, attention_mask = _example_inputs(model, self.batch)
+        with torch.inference_mode():
+            torch.onnx.export(audio, (waveform,), str(audio_path), opset_version=17,
+                              input_names=["waveform"], output_names=["embedding"])
+            torch.onnx.export(text, (input_ids, attention_mask), str(text_path), opset_version=17,
+                              input_names=["input_ids", "attention_mask"], output_names=["embedding"])
+
+    def audio(self, waveform: np.ndarray) -> np.ndarray:
+        return self._audio.run(None, {"waveform": waveform})[0]
+
+    def text(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        return self._text.run(None, {"input_ids": input_ids, "attention_mask": attention_mask})[0]
+
+
+def _in_fixed_batches(run, batch: int, *arrays: np.ndarray) -> np.ndarray:
+    """Run a fixed-batch graph over any number of rows, padding the last chunk with its last row."""
+    outputs = []
+    for start in range(0, len(arrays[0]), batch):
+        chunk = [array[start:start + batch] for array in arrays]
+        rows = len(chunk[0])
+        if rows < batch:
+            chunk = [
+                np.concatenate([part, np.repeat(part[-1:], batch - rows, axis=0)])
+                for part in chunk
+            ]
+        outputs.append(run(*chunk)[:rows])
+    return np.concatenate(outputs)
+
+
+class GraphModel:
+    """CLAP_Module stand-in that runs exported encoders.
+
+    Preprocessing (10 s crop/repeat-pad, int16 round trip, tokenization) is
+    laion-clap's own, so only the network itself is swapped out.
+    """
+
+    def __init__(self, model, runner):
+        self.model = model
+        self.runner = runner
+
+    def get_audio_embedding_from_data(self, x, use_tensor=False):
+        import torch
+        from laion_clap.training.data import float32_to_int16, get_audio_features, int16_to_float32
+
+        waveforms = []
+        for waveform in x:
+            waveform = torch.from_numpy(int16_to_float32(float32_to_int16(waveform))).float()
+            features = get_audio_features(
+                {}, waveform, _AUDIO_SAMPLES,
+                data_truncating="rand_trunc",
+                data_filling="repeatpad",
+                audio_cfg=self.model.model_cfg["audio_cfg"],
+            )
+            waveforms.append(features["waveform"].numpy())
+
+        embeddings = _in_fixed_batches(self.runner.audio, self.runner.batch, np.stack(waveforms))
+        return torch.from_numpy(embeddings) if use_tensor else embeddings
+
+    def get_text_embedding(self, x, use_tensor=False):
+        import torch
+        input_ids, attention_mask = _tokenize(self.model, x)
+        embeddings = _in_fixed_batches(
+            self.runner.text, self.runner.batch, input_ids.numpy(), attention_mask.numpy(),
+        )
+        return torch.from_numpy(embeddings) if use_tensor else embeddings
+
+
+# ---- parity check ----
+
+_PROMPTS = [
+    "upbeat summer pop with bright synths",
+    "melancholic piano ballad",
+    "aggressive heavy metal with double bass drums",
+    "lo-fi hip hop beats to study to",
+    "acoustic folk with fingerpicked guitar",
+    "dark ambient drone",
+    "eighties synthwave with gated reverb drums",
+    "jazz trio with upright bass and brushes",
+]
+
+
+def _cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return np.sum(a * b, axis=1)
+
+
+def _timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return np.asarray(result), time.perf_counter() - started
+
+
+def parity_check(backend: str, samples: int) -> dict:
+    """Embed the same audio and prompts with fp32 eager and `backend`; report drift and speed."""
+    import laion_clap
+
+    from .audio import AUDIO_EXTENSIONS, load_crop
+    from .clap import resolve_checkpoint
+
+    configure_threads()
+
+    def load():
+        model = laion_clap.CLAP_Module(enable_fusion=False, amodel=settings.clap_amodel)
+        model.load_ckpt(ckpt=resolve_checkpoint(settings.clap_checkpoint))
+        return model
+
+    extensions = set(AUDIO_EXTENSIONS.values())
+    files = sorted(p for p in settings.audio_dir.iterdir() if p.suffix in extensions)[:samples]
+    # Cropped once, so both models see the same 10 s window
+    waveforms = [w for w in (load_crop(str(f)) for f in files) if w is not None]
+    if not waveforms:
+        raise SystemExit(f"No decodable audio in {settings.audio_dir}")
+
+    reference = load()
+    candidate = build_backend(load(), backend)
+
+    ref_audio, ref_audio_s = _timed(reference.get_audio_embedding_from_data, waveforms)
+    out_audio, out_audio_s = _timed(candidate.get_audio_embedding_from_data, waveforms)
+    ref_text, ref_text_s = _timed(reference.get_text_embedding, _PROMPTS)
+    out_text, out_text_s = _timed(candidate.get_text_embedding, _PROMPTS)
+    # A lone query (the usual /api/search call) takes a different tokenizer path
+    out_single, _ = _timed(candidate.get_text_embedding, _PROMPTS[:1])
+
+    audio_cos = _cosine(ref_audio, out_audio)
+    text_cos = _cosine(ref_text, out_text)
+    single_cos = _cosine(ref_text[:1], np.atleast_2d(out_single))
+    return {
+        "backend": backend,
+        "audio": {
+            "samples": len(waveforms),
+            "cosine_mean": round(float(audio_cos.mean()), 5),
+            "cosine_min": round(float(audio_cos.min()), 5),
+            "speedup": round(ref_audio_s / out_audio_s, 2),
+        },
+        "text": {
+            "samples": len(_PROMPTS),
+            "cosine_mean": round(float(text_cos.mean()), 5),
+            "cosine_min": round(float(text_cos.min()), 5),
+            "single_prompt_cosine": round(float(single_cos[0]), 5),
+            "speedup": round(ref_text_s / out_text_s, 2),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare a CLAP inference backend against fp32 eager")
+    parser.add_argument("--backend", choices=BACKENDS[1:], default="int8")
+    parser.add_argument("--samples", type=int, default=32, help="audio files from audio_dir to embed")
+    args = parser.parse_args()
+
+    report = parity_check(args.backend, args.samples)
+    for kind in ("audio", "text"):
+        r = report[kind]
+        print(f"{args.backend} {kind}: cosine mean {r['cosine_mean']} min {r['cosine_min']} "
+              f"over {r['samples']} samples, {r['speedup']}x vs fp32")
+    print(f"{args.backend} text, one prompt: cosine {report['text']['single_prompt_cosine']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, text
+from sqlmodel import Session, select, func, update
+
+from .config import settings
+from .database import get_session
+from .metrics import Collected
+from .models import Job, Song
+
+# Which songs each job kind picks up when enqueuing
+_PENDING = {
+    "download": "download_status = 'pending'",
+    "embed": "download_status = 'done' AND embed_status = 'pending'",
+}
+
+# Songs whose work a job kind no longer needs to do
+_FINISHED = {
+    "download": "song.download_status = 'done'",
+    "embed": "song.embed_status = 'stored'",
+}
+
+# Song status column driven by each job kind
+_STATUS_COLUMN = {
+    "download": "download_status",
+    "embed": "embed_status",
+}
+
+
+@contextmanager
+def _session(session: Session | None):
+    """Use the caller's session (one transaction for several writes), or a fresh one."""
+    if session is not None:
+        yield session
+    else:
+        with get_session() as session:
+            yield session
+
+
+def enqueue(kind: str, spotify_ids: list[str] | None = None, session: Session | None = None) -> int:
+    """Queue a job for every pending song in one INSERT ... SELECT; returns outstanding count.
+
+    `spotify_ids` limits the candidates to those songs. Finished jobs for
+    songs that are pending again (e.g. a file went missing) are re-queued
+    with a fresh attempt count.
+    """
+    now = datetime.utcnow()
+    where = _PENDING[kind]
+    if spotify_ids is not None:
+        where += " AND spotify_id IN :spotify_ids"
+
+    statement = text(
+        "INSERT INTO job (kind, spotify_id, status, attempts, run_at, created_at, updated_at) "
+        f"SELECT :kind, spotify_id, 'queued', 0, :now, :now, :now FROM song WHERE {where} "
+        "ON CONFLICT (kind, spotify_id) DO UPDATE SET "
+        "status = 'queued', attempts = 0, run_at = :now, last_error = NULL, updated_at = :now "
+        "WHERE job.status IN ('done', 'failed')"
+    )
+    params = {"kind": kind, "now": now}
+    if spotify_ids is not None:
+        statement = statement.bindparams(bindparam("spotify_ids", expanding=True))
+        params["spotify_ids"] = list(spotify_ids)
+
+    with _session(session) as session:
+        session.execute(statement, params)
+        return outstanding(kind, session)
+
+
+def outstanding(kind: str, session: Session | None = None) -> int:
+    """Jobs of a kind that are queued or leased."""
+    with _session(session) as session:
+        return session.exec(
+            select(func.count()).select_from(Job).where(
+                Job.kind == kind,
+                Job.status.in_(["queued", "leased"]),
+            )
+        ).one()
+
+
+def claim(kind: str, limit: int) -> list[dict]:
+    """Lease up to `limit` runnable jobs and return them with their song data.
+
+    Runnable means queued and due, or leased with an expired lease. The
+    claim is a single UPDATE ... RETURNING, so concurrent claimers never
+    get the same job. Runnable jobs whose song was finished meanwhile
+    (e.g. reconcile found its file) are completed first instead of run.
+    """
+    now = datetime.utcnow()
+    lease_expires_at = now + timedelta(seconds=settings.job_lease_seconds)
+    runnable = (
+        "kind = :kind AND ("
+        "  (status = 'queued' AND run_at <= :now) OR "
+        "  (status = 'leased' AND lease_expires_at < :now)"
+        ")"
+    )
+
+    with get_session() as session:
+        session.execute(
+            text(
+                "UPDATE job SET status = 'done', lease_expires_at = NULL, updated_at = :now "
+                f"WHERE {runnable} AND EXISTS ("
+                f"  SELECT 1 FROM song WHERE song.spotify_id = job.spotify_id AND {_FINISHED[kind]}"
+                ")"
+            ),
+            {"kind": kind, "now": now},
+        )
+        claimed = session.execute(
+            text(
+                "UPDATE job SET status = 'leased', attempts = attempts + 1, "
+                "lease_expires_at = :lease_expires_at, updated_at = :now "
+                "WHERE id IN ("
+                f"  SELECT id FROM job WHERE {runnable} ORDER BY id LIMIT :limit"
+                ") RETURNING id, spotify_id, attempts"
+            ),
+            {"kind": kind, "now": now, "lease_expires_at": lease_expires_at, "limit": limit},
+        ).all()
+        if not claimed:
+            return []
+
+        songs = {
+            s.spotify_id: s
+            for s in session.exec(
+                select(Song).where(Song.spotify_id.in_([row.spotify_id for row in claimed]))
+            ).all()
+        }
+
+        # Extract data before session closes, in claim order
+        return [
+            {
+                "job_id": row.id,
+                "attempts": row.attempts,
+                "spotify_id": s.spotify_id,
+                "title": s.title,
+                "artist": s.artist,
+                "album": s.album,
+                "album_art_url": s.album_art_url,
+                "spotify_link": s.spotify_link,
+                "file_path": s.file_path,
+            }
+            for row in sorted(claimed, key=lambda row: row.id)
+            if (s := songs.get(row.spotify_id)) is not None
+        ]
+
+
+def complete(job_ids: list[int], session: Session | None = None):
+    """Mark jobs done."""
+    if not job_ids:
+        return
+    with _session(session) as session:
+        session.execute(
+            update(Job)
+            .where(Job.id.in_(job_ids))
+            .values(status="done", lease_expires_at=None, updated_at=datetime.utcnow())
+        )
+
+
+def fail(kind: str, jobs: list[dict], error: str | None = None, session: Session | None = None):
+    """Retry jobs with exponential backoff, or fail them for good after max attempts.
+
+    The song's status follows: back to pending while a retry is queued,
+    failed once attempts run out.
+    """
+    if not jobs:
+        return
+    now = datetime.utcnow()
+    column = getattr(Song, _STATUS_COLUMN[kind])
+
+    with _session(session) as session:
+        for job in jobs:
+            if job["attempts"] >= settings.job_max_attempts:
+                status, song_status, run_at = "failed", "failed", now
+            else:
+                delay = settings.job_retry_base_seconds * 2 ** (job["attempts"] - 1)
+                status, song_status, run_at = "queued", "pending", now + timedelta(seconds=delay)
+
+            session.execute(
+                update(Job)
+                .where(Job.id == job["job_id"])
+                .values(status=status, run_at=run_at, lease_expires_at=None,
+                        last_error=error, updated_at=now)
+            )
+            session.execute(
+                update(Song)
+                .where(Song.spotify_id == job["spotify_id"])
+                .values({column: song_status, "updated_at": now})
+            )
+
+
+def set_status(kind: str, updates: list[tuple[str, str, str | None]], session: Session | None = None):
+    """Set the song status driven by a job kind for many songs in one executemany.
+
+    `updates` are (spotify_id, status, file_path) rows; a None file_path
+    leaves the stored path alone.
+    """
+    if not updates:
+        return
+    column = _STATUS_COLUMN[kind]
+    now = datetime.utcnow()
+    with _session(session) as session:
+        session.execute(
+            text(
+                f"UPDATE song SET {column} = :status, file_path = COALESCE(:file_path, file_path), "
+                "updated_at = :now WHERE spotify_id = :spotify_id"
+            ),
+            [
+                {"spotify_id": spotify_id, "status": status, "file_path": file_path, "now": now}
+                for spotify_id, status, file_path in updates
+            ],
+        )
+
+
+def seconds_until_next(kind: str) -> float | None:
+    """Seconds until the next queued job of a kind is due; None if there are none."""
+    with get_session() as session:
+        next_run_at = session.exec(
+            select(func.min(Job.run_at)).where(Job.kind == kind, Job.status == "queued")
+        ).one()
+    if next_run_at is None:
+        return None
+    return max(0.0, (next_run_at - datetime.utcnow()).total_seconds())
+
+
+def recover() -> dict[str, int]:
+    """Undo the effects of a crash; returns outstanding jobs per kind.
+
+    Nothing is running at startup, so leased jobs go straight back to the
+    queue and songs stuck mid-transition become pending again.
+    """
+    now = datetime.utcnow()
+    with get_session() as session:
+        session.execute(
+            update(Job)
+            .where(Job.status == "leased")
+            .values(status="queued", lease_expires_at=None, run_at=now, updated_at=now)
+        )
+        session.execute(
+            update(Song)
+            .where(Song.download_status == "downloading")
+            .values(download_status="pending", updated_at=now)
+        )
+        session.execute(
+            update(Song)
+            .where(Song.embed_status == "processing")
+            .values(embed_status="pending", updated_at=now)
+        )
+    return {kind: outstanding(kind) for kind in _PENDING}
+
+
+def depths() -> dict[tuple[str, str], int]:
+    """Queued and leased job counts per kind, in one GROUP BY."""
+    with get_session() as session:
+        rows = session.exec(
+            select(Job.kind, Job.status, func.count())
+            .where(Job.status.in_(["queued", "leased"]))
+            .group_by(Job.kind, Job.status)
+        ).all()
+    counts = {(kind, status): 0 for kind in _PENDING for status in ("queued", "leased")}
+    counts.update({(kind, status): count for kind, status, count in rows})
+    return counts
+
+
+Collected("vibe_queue_depth", "Jobs waiting (queued) or running (leased) per kind.",
+          depths, labels=("kind", "status"))
@@ -1,11 +1,24 @@
+import asyncio
 import os
+import threading
+import time
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-
-from .database import init_db
-from .routers import sync, download, embed, search
+from fastapi.responses import FileResponse
+
+from . import jobs, metrics
+from .clap import model_manager
+from .config import settings
+from .database import init_db, run_db
+from .embedding_cache import embedding_cache
+from .index import get_index
+from .profiler import PROFILE_DIR, Profile, sampler, slow_requests
+from .reconcile import reconcile_embeddings
+from .routers import sync, download, embed, search, pipeline
+from .text_cache import text_cache
+from .write_behind import writes
 
 # Suppress some warnings
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
@@ -16,15 +29,45 @@ async def lifespan(app: FastAPI):
     # Startup: Initialize database
     init_db()
 
-    # Load CLAP model (lazy - only when first embed is requested)
-    # This avoids slow startup and memory usage if not needed
-    # The model will be loaded on first /api/embed call
-    print("Database initialized. CLAP model will load on first embed request.")
+    # Load and warm up CLAP in the background; requests wait on readiness
+    if settings.clap_load_on_startup:
+        model_manager.start()
+        print("Database initialized. CLAP model loading in the background.")
+    else:
+        print("Database initialized. CLAP model will load on first use.")
+
+    # Slow-request capture pulls from a rolling window of samples
+    if slow_requests is not None:
+        sampler.keep_history(settings.profile_history_seconds)
+
+    # Build the in-memory search index from ChromaDB without delaying startup
+    threading.Thread(target=_prepare_search, daemon=True).start()
+
+    # Pick up download/embed jobs interrupted by a crash or restart
+    outstanding = await run_db(jobs.recover)
+    await download.resume(outstanding["download"])
+    asyncio.create_task(embed.resume(outstanding["embed"]))
 
     yield
 
     # Shutdown: cleanup
     print("Shutting down...")
+    try:
+        await writes.drain()
+    except Exception:
+        # Logged by the flush; the leased jobs are recovered on the next start
+        pass
+    download.shutdown()
+    embed.shutdown()
+
+
+def _prepare_search():
+    """Queue songs whose vectors come from another CLAP model, then build the index."""
+    try:
+        reconcile_embeddings()
+    except Exception as e:
+        print(f"Startup embedding check failed: {e}")
+    get_index()
 
 
 app = FastAPI(
@@ -48,6 +91,49 @@ app.include_router(sync.router, prefix="/api", tags=["sync"])
 app.include_router(download.router, prefix="/api", tags=["download"])
 app.include_router(embed.router, prefix="/api", tags=["embed"])
 app.include_router(search.router, prefix="/api", tags=["search"])
+app.include_router(pipeline.router, prefix="/api", tags=["pipeline"])
+
+# Whole-process profile state
+_profile_state = {
+    "runner": None,  # task that stops the profile when its time is up
+    "last": None,  # file name of the last finished profile
+}
+
+
+# Values of ?profile= / X-Profile that switch request profiling on (as pydantic parses bools)
+_TRUE = {"1", "true", "yes", "on", "t", "y"}
+
+
+def _profile_flag(request: Request) -> bool:
+    """Whether a request asked to be profiled; "0", "false" and the like do not."""
+    value = request.headers.get("x-profile") or request.query_params.get("profile") or ""
+    return value.strip().lower() in _TRUE
+
+
+if settings.profiling_enabled or slow_requests is not None:
+    @app.middleware("http")
+    async def profile_requests(request: Request, call_next):
+        """Profile flagged requests and keep samples for the slowest ones."""
+        profile = None
+        if settings.profiling_enabled and _profile_flag(request):
+            profile = Profile()
+            sampler.attach(profile)
+
+        started = time.perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            if profile is not None:
+                sampler.detach(profile)
+        finished = time.perf_counter()
+
+        name = f"{request.method} {request.url.path}"
+        if profile is not None:
+            path = await asyncio.to_thread(profile.write, f"request-{name}")
+            response.headers["X-Profile"] = path.name
+        if slow_requests is not None and slow_requests.ranks(finished - started):
+            await asyncio.to_thread(slow_requests.offer, finished - started, name, started, finished)
+        return response
 
 
 @app.get("/health")
@@ -57,15 +143,97 @@ async def health():
 
 @app.post("/api/load-model")
 async def load_clap_model():
-    """Manually load the CLAP model (optional - loads automatically on first embed)."""
-    if embed.get_model() is not None:
+    """Load the CLAP model now (optional - it loads at startup or on first use)."""
+    if model_manager.get() is not None:
         return {"status": "already_loaded"}
 
+    if await model_manager.wait() is None:
+        return {"status": "error", "message": model_manager.error}
+    return {"status": "loaded"}
+
+
+@app.get("/api/model")
+async def model_status():
+    """CLAP model readiness: idle, loading, ready or failed."""
+    return model_manager.status()
+
+
+def _cache_counts() -> dict[str, tuple[int, int]]:
+    """(hits, misses) per cache."""
+    counts = {"text": (text_cache.hits + text_cache.disk_hits, text_cache.misses)}
+    if embedding_cache is not None:
+        counts["embedding"] = (embedding_cache.hits, embedding_cache.misses)
+    return counts
+
+
+metrics.Collected("vibe_cache_hits_total", "Cache lookups served without inference.",
+                  lambda: {(name,): hits for name, (hits, _) in _cache_counts().items()},
+                  labels=("cache",), kind="counter")
+metrics.Collected("vibe_cache_misses_total", "Cache lookups that needed inference.",
+                  lambda: {(name,): misses for name, (_, misses) in _cache_counts().items()},
+                  labels=("cache",), kind="counter")
+metrics.Collected("vibe_cache_hit_ratio", "Hits over lookups since startup.",
+                  lambda: {(name,): hits / (hits + misses) if hits + misses else 0.0
+                           for name, (hits, misses) in _cache_counts().items()},
+                  labels=("cache",))
+metrics.Collected("vibe_model_ready", "1 once the CLAP model is loaded and warmed up.",
+                  lambda: int(model_manager.state == "ready"))
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus text-format metrics (collectors may query SQLite, so off the loop)."""
+    return Response(await run_db(metrics.render), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def _require_profiling():
+    if not settings.profiling_enabled:
+        raise HTTPException(status_code=403, detail="Profiling is disabled (set PROFILING_ENABLED=true)")
+
+
+@app.post("/api/profile")
+async def start_profile(seconds: float = 30):
+    """Sample the whole process (background download/embed/sync work included) for a while."""
+    _require_profiling()
+    runner = _profile_state["runner"]
+    if runner is not None and not runner.done():
+        raise HTTPException(status_code=409, detail="A profile is already running")
+
+    seconds = min(max(seconds, 0.1), settings.profile_max_seconds)
+    profile = Profile()
+    sampler.attach(profile)
+    _profile_state["runner"] = asyncio.create_task(_finish_profile(profile, seconds))
+    return {"status": "started", "seconds": seconds}
+
+
+async def _finish_profile(profile: Profile, seconds: float):
     try:
-        import laion_clap
-        model = laion_clap.CLAP_Module(enable_fusion=False, amodel='HTSAT-base')
-        model.load_ckpt()  # Downloads checkpoint if needed
-        embed.set_model(model)
-        return {"status": "loaded"}
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+        await asyncio.sleep(seconds)
+    finally:
+        sampler.detach(profile)
+    path = await asyncio.to_thread(profile.write, f"process-{seconds:g}s")
+    _profile_state["last"] = path.name
+    print(f"Profile written to {path} ({profile.samples} samples)")
+
+
+@app.get("/api/profile")
+async def list_profiles():
+    """Whole-process profile status, the slowest captured requests and every saved profile."""
+    _require_profiling()
+    runner = _profile_state["runner"]
+    return {
+        "running": runner is not None and not runner.done(),
+        "last": _profile_state["last"],
+        "slowest": slow_requests.list() if slow_requests is not None else [],
+        "files": sorted(p.name for p in PROFILE_DIR.glob("*.folded")) if PROFILE_DIR.exists() else [],
+    }
+
+
+@app.get("/api/profile/{name}")
+async def get_profile(name: str):
+    """Download a saved profile (folded stacks)."""
+    _require_profiling()
+    path = PROFILE_DIR / name
+    if path.name != name or path.suffix != ".folded" or not path.is_file():
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain")
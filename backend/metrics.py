@@ -0,0 +1,180 @@
+"""Prometheus metrics without a client library.
+
+Counters and histograms are updated inline: a lock, an add and (for
+histograms) a bisect into fixed buckets, cheap enough to leave on under
+load. Gauges for things that already live in module state (queue depths,
+in-flight counts, cache counters) are collected by callbacks at scrape
+time, so the hot paths pay nothing for them.
+
+    GET /metrics → Prometheus text format (version 0.0.4)
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable
+
+# Seconds; spans a cached text lookup up to a slow yt-dlp run
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+)
+
+# Registered metrics, rendered in registration order
+_registry: list = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing count per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            yield self.name, _labels(self.labels, label_values), value
+
+
+class Histogram:
+    """Observations counted into fixed cumulative buckets, plus sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # label values → [per-bucket counts (last is +Inf), sum]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, *label_values):
+        slot = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][slot] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        """Observe how long the block takes (also when it raises)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def totals(self) -> dict[tuple, tuple[int, float]]:
+        """(count, sum) per label set."""
+        with self._lock:
+            return {key: (sum(counts), total) for key, (counts, total) in self._values.items()}
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for label_values, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                yield f"{self.name}_bucket", _labels(self.labels, label_values, le), cumulative
+            yield f"{self.name}_sum", _labels(self.labels, label_values), total
+            yield f"{self.name}_count", _labels(self.labels, label_values), cumulative
+
+
+class Collected:
+    """A gauge or counter read from existing state at scrape time.
+
+    `collect` returns a number, or a dict of label-value tuples to numbers.
+    """
+
+    def __init__(self, name: str, help: str, collect: Callable, labels: tuple[str, ...] = (),
+                 kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.kind = kind
+        self.collect = collect
+        _registry.append(self)
+
+    def samples(self):
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in sorted(values.items()):
+            if value is not None:
+                yield self.name, _labels(self.labels, label_values), value
+
+
+def render() -> str:
+    """Every registered metric in Prometheus text format."""
+    lines = []
+    for metric in _registry:
+        try:
+            samples = list(metric.samples())
+        except Exception as e:
+            # One broken collector shouldn't take down the scrape
+            print(f"Metrics collection failed for {metric.name}: {e}")
+            continue
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(f"{name}{labels} {_number(value)}" for name, labels, value in samples)
+    return "\n".join(lines) + "\n"
+
+
+# ---- shared instruments ----
+
+stage_seconds = Histogram(
+    "vibe_stage_seconds",
+    "Time per unit of work in each pipeline stage (a download, a decode, an inference batch, a flush).",
+    labels=("stage",),
+)
+stage_items = Counter(
+    "vibe_stage_items_total",
+    "Songs (or queries) processed per pipeline stage, by outcome.",
+    labels=("stage", "outcome"),
+)
+search_seconds = Histogram(
+    "vibe_search_seconds",
+    "Search latency by phase: encode (CLAP text), query (vector search), hydrate (results).",
+    labels=("phase",),
+)
+sqlite_session_seconds = Histogram(
+    "vibe_sqlite_session_seconds",
+    "Time from opening a SQLite session to its commit or rollback.",
+)
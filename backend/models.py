@@ -2,13 +2,19 @@ from datetime import datetime
 from typing import Optional
 
 from pydantic import BaseModel
-from sqlmodel import SQLModel, Field
+from sqlmodel import SQLModel, Field, Index, UniqueConstraint
 
 
 # ============ Database Models (SQLModel) ============
 
 class Song(SQLModel, table=True):
     """Song record in SQLite database."""
+    __table_args__ = (
+        # Pending-work queries filter on both statuses
+        Index("ix_song_download_embed", "download_status", "embed_status"),
+        Index("ix_song_embed_download", "embed_status", "download_status"),
+    )
+
     spotify_id: str = Field(primary_key=True)
     title: str
     artist: str
@@ -24,15 +30,44 @@ class Song(SQLModel, table=True):
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 
+class SyncSource(SQLModel, table=True):
+    """Last successful sync of a playlist (or "liked" for liked songs)."""
+    source_id: str = Field(primary_key=True)
+    snapshot_id: Optional[str] = None  # playlist version from Spotify
+    added_at_watermark: Optional[datetime] = None  # newest added_at seen
+    track_count: int = 0
+    synced_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class Job(SQLModel, table=True):
+    """Durable queue entry: one pipeline stage for one song."""
+    __table_args__ = (
+        UniqueConstraint("kind", "spotify_id"),
+        Index("ix_job_claim", "kind", "status", "run_at"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str  # download | embed
+    spotify_id: str
+    status: str = Field(default="queued")  # queued | leased | done | failed
+    attempts: int = 0
+    run_at: datetime = Field(default_factory=datetime.utcnow)  # not before (retry backoff)
+    lease_expires_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
 # ============ API Request/Response Models (Pydantic) ============
 
 class SyncRequest(BaseModel):
     playlist_id: str
+    full: bool = False  # ignore the stored snapshot and walk every page
 
 
 class SearchRequest(BaseModel):
     query: str
-    n_results: int = 20
+    n_results: int = Field(default=20, ge=1, le=100)
 
 
 class SearchResult(BaseModel):
@@ -73,3 +108,4 @@ class LibraryStats(BaseModel):
 class LibraryResponse(BaseModel):
     songs: list[SongResponse]
     stats: LibraryStats
+    next_cursor: Optional[str] = None  # pass back as ?cursor= for the next page
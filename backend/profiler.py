@@ -0,0 +1,228 @@
+"""Sampling profiler writing folded stacks (flamegraph.pl / speedscope input).
+
+A background thread snapshots every thread's Python stack each
+`profile_interval_ms` via sys._current_frames(); nothing is traced, so the
+profiled code runs at full speed. Profiles are written to
+data_dir/profiles as one "thread;frame;frame count" line per stack:
+
+    flamegraph.pl data/profiles/request-....folded > flame.svg
+
+Threads parked in an idle wait (an empty executor, the event loop's
+select) are left out so the output shows work, not waiting.
+"""
+import heapq
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from pathlib import Path
+
+from .config import settings
+
+PROFILE_DIR = settings.data_dir / "profiles"
+
+# Leaf frames (file name, function) of threads that are waiting, not working
+_IDLE = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),  # concurrent.futures worker blocked on its queue
+    ("process.py", "_process_worker"),
+    ("connection.py", "_recv"),
+}
+
+
+class Profile:
+    """Stack counts collected while attached to the sampler."""
+
+    def __init__(self):
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+        self.started = time.perf_counter()
+
+    def add(self, stacks: list[str]):
+        self.samples += 1
+        self.stacks.update(stacks)
+
+    def write(self, name: str) -> Path:
+        """Save as a .folded file under data_dir/profiles."""
+        return write_folded(self.stacks, name)
+
+
+class Sampler:
+    """One background thread feeding every attached Profile.
+
+    It runs only while a profile is attached or, for slow-request capture,
+    while a rolling history of recent samples is kept.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.history_seconds = 0.0
+        self._profiles: set[Profile] = set()
+        self._history: deque[tuple[float, list[int]]] = deque()  # stacks as ids
+        self._labels: dict = {}
+        self._stack_ids: dict[tuple, int] = {}  # (thread, code objects) → id
+        self._stacks: list[str] = []  # id → folded stack
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def attach(self, profile: Profile):
+        with self._lock:
+            self._profiles.add(profile)
+            self._ensure_running()
+
+    def detach(self, profile: Profile):
+        with self._lock:
+            self._profiles.discard(profile)
+
+    def keep_history(self, seconds: float):
+        """Keep the last `seconds` of samples so a past time window can be pulled out."""
+        with self._lock:
+            self.history_seconds = seconds
+            self._ensure_running()
+
+    def window(self, start: float, end: float) -> Counter[str]:
+        """Stack counts sampled between two perf_counter times (from the history)."""
+        with self._lock:
+            history = list(self._history)
+        ids: Counter[int] = Counter()
+        for at, sample in history:
+            if start <= at <= end:
+                ids.update(sample)
+        return Counter({self._stacks[i]: count for i, count in ids.items()})
+
+    def _ensure_running(self):
+        if self._thread is None and (self._profiles or self.history_seconds):
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            with self._lock:
+                if not self._profiles and not self.history_seconds:
+                    self._thread = None
+                    return
+
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            now = time.perf_counter()
+            ids = [
+                stack_id
+                for ident, frame in sys._current_frames().items()
+                if ident != me
+                and (stack_id := self._stack_id(names.get(ident, str(ident)), frame)) is not None
+            ]
+
+            with self._lock:
+                if self._profiles:
+                    stacks = [self._stacks[i] for i in ids]
+                    for profile in self._profiles:
+                        profile.add(stacks)
+                if self.history_seconds:
+                    self._history.append((now, ids))
+                    while self._history and self._history[0][0] < now - self.history_seconds:
+                        self._history.popleft()
+
+            time.sleep(self.interval)
+
+    def _stack_id(self, thread_name: str, frame) -> int | None:
+        """Interned id of a thread's stack, or None for an idle thread.
+
+        Stacks are keyed by their code objects, so a stack seen before costs
+        a frame walk and a dict lookup; history keeps only the ids.
+        """
+        code = frame.f_code
+        if (Path(code.co_filename).name, code.co_name) in _IDLE:
+            return None
+
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        key = (thread_name, tuple(codes))
+        stack_id = self._stack_ids.get(key)
+        if stack_id is None:
+            stack_id = self._stack_ids[key] = len(self._stacks)
+            self._stacks.append(self._fold(thread_name, codes))
+        return stack_id
+
+    def _fold(self, thread_name: str, codes: list) -> str:
+        """thread;outermost;...;innermost, from innermost-first code objects."""
+        labels = []
+        for code in codes:
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+            labels.append(label)
+        labels.append(thread_name)
+        return ";".join(reversed(labels))
+
+
+class SlowRequests:
+    """Keeps folded stacks for the N slowest requests seen since startup."""
+
+    def __init__(self, sampler: Sampler, keep: int):
+        self.sampler = sampler
+        self.keep = keep
+        self._slowest: list[tuple[float, str, str]] = []  # min-heap of (seconds, request, file)
+        self._lock = threading.Lock()
+
+    def ranks(self, seconds: float) -> bool:
+        """Whether a request this slow would be kept (cheap pre-check for offer)."""
+        return len(self._slowest) < self.keep or seconds > self._slowest[0][0]
+
+    def offer(self, seconds: float, request: str, start: float, end: float):
+        """Save this request's samples if it ranks among the slowest."""
+        with self._lock:
+            if len(self._slowest) >= self.keep and seconds <= self._slowest[0][0]:
+                return
+            stacks = self.sampler.window(start, end)
+            if not stacks:
+                return
+            path = write_folded(stacks, f"slow-{round(seconds * 1000)}ms-{request}")
+            heapq.heappush(self._slowest, (seconds, request, path.name))
+            if len(self._slowest) > self.keep:
+                _, _, evicted = heapq.heappop(self._slowest)
+                (PROFILE_DIR / evicted).unlink(missing_ok=True)
+
+    def list(self) -> list[dict]:
+        with self._lock:
+            slowest = sorted(self._slowest, reverse=True)
+        return [
+            {"seconds": round(seconds, 4), "request": request, "file": file}
+            for seconds, request, file in slowest
+        ]
+
+
+def _short_path(filename: str) -> str:
+    """Repo-relative for our code, from site-packages / the stdlib otherwise."""
+    path = filename.replace("\\", "/")
+    base = str(settings.base_dir).replace("\\", "/") + "/"
+    if path.startswith(base):
+        return path[len(base):]
+    for marker in ("/site-packages/", "/dist-packages/", "/lib/python"):
+        if marker in path:
+            return path.split(marker, 1)[1]
+    return path
+
+
+def write_folded(stacks: Counter[str], name: str) -> Path:
+    """Write stack counts as folded lines to data_dir/profiles/<timestamp>-<name>.folded."""
+    PROFILE_DIR.mkdir(exist_ok=True)
+    slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_")[:80]
+    path = PROFILE_DIR / f"{datetime.now():%Y%m%d-%H%M%S-%f}-{slug}.folded"
+    with open(path, "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    return path
+
+
+# Shared sampler; idle (no thread) until something attaches
+sampler = Sampler(interval=settings.profile_interval_ms / 1000)
+
+# Slowest-request capture, when enabled
+slow_requests = SlowRequests(sampler, settings.profile_slow_requests) if settings.profile_slow_requests else None
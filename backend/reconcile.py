@@ -0,0 +1,161 @@
+import os
+from datetime import datetime
+
+from sqlmodel import func, select, update
+
+from . import jobs
+from .audio import AUDIO_EXTENSIONS
+from .clap import LEGACY_MODEL_KEY, clap_model_key, vector_model
+from .config import settings
+from .database import get_session
+from .db import collection
+from .models import Song
+
+# Ids per IN (...) update, well under SQLite's variable limit
+_CHUNK = 500
+
+# Ids fetched per page when listing the ChromaDB collection
+_ID_PAGE_SIZE = 5000
+
+# What the last reconcile left consistent; an unchanged snapshot means
+# nothing can have drifted, so the scan is skipped
+_state = {
+    "downloads": None,  # (audio_dir mtime, song count)
+    "embeddings": None,  # (collection count, stored count)
+}
+
+
+def scan_audio() -> dict[str, str]:
+    """spotify_id → audio file for everything in audio_dir, from one directory listing.
+
+    When a song has files from more than one download mode, the current
+    mode's wins.
+    """
+    preferred = AUDIO_EXTENSIONS[settings.download_mode]
+    extensions = set(AUDIO_EXTENSIONS.values())
+    found = {}
+    with os.scandir(settings.audio_dir) as entries:
+        for entry in entries:
+            spotify_id, extension = os.path.splitext(entry.name)
+            if extension not in extensions or not entry.is_file():
+                continue
+            if spotify_id not in found or extension == preferred:
+                found[spotify_id] = entry.path
+    return found
+
+
+def _chroma_models() -> dict[str, str]:
+    """spotify_id → CLAP model key for every vector in ChromaDB, without the embeddings.
+
+    Vectors stored before the model was recorded are tagged with the legacy
+    key on the way, so search can filter on it.
+    """
+    models = {}
+    offset = 0
+    while True:
+        page = collection.get(limit=_ID_PAGE_SIZE, offset=offset, include=["metadatas"])
+        if not page["ids"]:
+            return models
+        untagged = []
+        for spotify_id, metadata in zip(page["ids"], page["metadatas"]):
+            models[spotify_id] = vector_model(metadata)
+            if "clap_model" not in (metadata or {}):
+                untagged.append((spotify_id, {**(metadata or {}), "clap_model": LEGACY_MODEL_KEY}))
+        if untagged:
+            collection.update(ids=[i for i, _ in untagged], metadatas=[m for _, m in untagged])
+        offset += len(page["ids"])
+
+
+def _bulk_update(session, spotify_ids: list[str], **values):
+    for start in range(0, len(spotify_ids), _CHUNK):
+        session.execute(
+            update(Song)
+            .where(Song.spotify_id.in_(spotify_ids[start:start + _CHUNK]))
+            .values(**values, updated_at=datetime.utcnow())
+        )
+
+
+def reconcile_downloads(force: bool = False) -> dict:
+    """Sync download_status with the files in audio_dir.
+
+    A file for a song that isn't done marks it done (songs mid-download are
+    left to their runner); a done song without a file goes back to pending.
+    Skipped when neither the directory nor the song table changed since the
+    last reconcile.
+    """
+    fixed = {"marked_done": 0, "marked_pending": 0, "path_updated": 0}
+
+    with get_session() as session:
+        snapshot = (
+            os.stat(settings.audio_dir).st_mtime_ns,
+            session.exec(select(func.count()).select_from(Song)).one(),
+        )
+        if not force and snapshot == _state["downloads"]:
+            return {**fixed, "skipped": True}
+
+        files = scan_audio()
+        done, pending = [], []
+        for spotify_id, status, file_path in session.exec(
+            select(Song.spotify_id, Song.download_status, Song.file_path)
+        ).all():
+            path = files.get(spotify_id)
+            if path is not None and status not in ("done", "downloading"):
+                done.append((spotify_id, "done", path))
+                fixed["marked_done"] += 1
+            elif path is not None and status == "done" and file_path != path:
+                done.append((spotify_id, "done", path))
+                fixed["path_updated"] += 1
+            elif path is None and status == "done":
+                pending.append(spotify_id)
+                fixed["marked_pending"] += 1
+
+        jobs.set_status("download", done, session=session)
+        _bulk_update(session, pending, download_status="pending", file_path=None)
+
+    # Our own fixes don't touch the directory or the row count
+    _state["downloads"] = snapshot
+    return {**fixed, "skipped": False}
+
+
+def reconcile_embeddings(force: bool = False) -> dict:
+    """Sync embed_status with the ids in ChromaDB.
+
+    Only vectors from the configured CLAP model count: search leaves the
+    others out, and re-embedding overwrites them, but nothing is deleted,
+    so switching models back keeps the old vectors usable. A stored song
+    without a current vector goes back to pending so it is embedded again;
+    a song with one but another status (other than mid-embed) is marked
+    stored. Vectors for songs no longer in the table are only counted.
+    Skipped when neither side's count changed since the last reconcile.
+    """
+    fixed = {"marked_stored": 0, "marked_pending": 0, "orphaned": 0, "other_model": 0}
+
+    with get_session() as session:
+        stored_count = session.exec(
+            select(func.count()).select_from(Song).where(Song.embed_status == "stored")
+        ).one()
+        snapshot = (collection.count(), stored_count)
+        if not force and snapshot == _state["embeddings"]:
+            return {**fixed, "skipped": True}
+
+        models = _chroma_models()
+        current = clap_model_key()
+        ids = {spotify_id for spotify_id, model in models.items() if model == current}
+        other_model = len(models) - len(ids)
+
+        stored, pending = [], []
+        for spotify_id, status in session.exec(select(Song.spotify_id, Song.embed_status)).all():
+            if spotify_id in ids:
+                ids.discard(spotify_id)
+                if status not in ("stored", "processing"):
+                    stored.append(spotify_id)
+            elif status == "stored":
+                pending.append(spotify_id)
+        fixed.update(marked_stored=len(stored), marked_pending=len(pending), orphaned=len(ids),
+                     other_model=other_model)
+
+        _bulk_update(session, stored, embed_status="stored")
+        _bulk_update(session, pending, embed_status="pending")
+
+    _state["embeddings"] = (snapshot[0], stored_count + len(stored) - len(pending))
+    return {**fixed, "skipped": False}
@@ -1,16 +1,19 @@
 import asyncio
-import json
-import subprocess
-from datetime import datetime
+import time
+from functools import partial
 from pathlib import Path
 
-from fastapi import APIRouter
-from sse_starlette.sse import EventSourceResponse
-from sqlmodel import select
+from fastapi import APIRouter, Header
 
+from .. import jobs
 from ..config import settings
-from ..database import get_session
-from ..models import Song
+from ..database import run_db
+from ..audio import audio_path
+from ..downloader import AdaptiveLimiter, DownloadPool, is_congestion, middle_section
+from ..events import bus, stream
+from ..metrics import Collected, stage_items, stage_seconds
+from ..reconcile import reconcile_downloads
+from ..write_behind import writes
 
 router = APIRouter()
 
@@ -25,97 +28,195 @@ _state = {
         "failed": 0,
     },
     "active_downloads": 0,
+    "runner": None,  # background task draining the job queue
+    "handoff": None,  # set by the pipeline to pass finished songs to the embedder
 }
 
-# Semaphore for concurrent downloads
-_semaphore = asyncio.Semaphore(settings.max_concurrent_downloads)
-
-
-def _verify_download_state():
-    """Sync database state with actual files on disk."""
-    fixed = {"marked_done": 0, "marked_pending": 0}
+# AIMD limit on concurrent downloads
+_limiter = AdaptiveLimiter(
+    initial=settings.max_concurrent_downloads,
+    minimum=settings.download_min_concurrency,
+    maximum=settings.download_max_concurrency,
+    congestion_threshold=settings.download_congestion_threshold,
+)
+
+# yt-dlp options, equivalent to:
+# yt-dlp -x --audio-format mp3 --audio-quality 5 --no-playlist --quiet --no-warnings
+_ydl_params = {
+    "format": "bestaudio/best",
+    "postprocessors": [{
+        "key": "FFmpegExtractAudio",
+        "preferredcodec": "mp3",
+        "preferredquality": "5",  # Medium quality, smaller files
+    }],
+    "noplaylist": True,
+    "quiet": True,
+    "no_warnings": True,
+    "noprogress": True,
+}
 
-    with get_session() as session:
-        songs = session.exec(select(Song)).all()
+if settings.download_mode == "sections":
+    # CLAP only looks at short windows: fetch one window of the Opus stream
+    # (already 48 kHz) and keep it as-is, instead of the whole track as MP3
+    _ydl_params.update({
+        "format": "bestaudio[acodec=opus]/bestaudio/best",
+        "download_ranges": partial(
+            middle_section,
+            seconds=settings.download_section_seconds,
+            center=settings.download_section_center,
+        ),
+        "postprocessors": [{
+            "key": "FFmpegExtractAudio",
+            "preferredcodec": "opus",  # stream copy when the source is Opus
+        }],
+    })
 
-        for song in songs:
-            file_path = settings.audio_dir / f"{song.spotify_id}.mp3"
-            file_exists = file_path.exists()
+# Long-lived yt-dlp worker processes, one per download slot
+_pool = DownloadPool(size=_limiter.maximum, params=_ydl_params)
 
-            # File exists but status isn't done → mark as done
-            if file_exists and song.download_status != "done":
-                db_song = session.get(Song, song.spotify_id)
-                if db_song:
-                    db_song.download_status = "done"
-                    db_song.file_path = str(file_path)
-                    db_song.updated_at = datetime.utcnow()
-                    fixed["marked_done"] += 1
+Collected("vibe_download_concurrency_limit", "Current adaptive limit on concurrent downloads.",
+          lambda: _limiter.limit)
+Collected("vibe_downloads_in_flight", "yt-dlp downloads currently running.",
+          lambda: _state["active_downloads"])
 
-            # File missing but status is done → mark as pending for re-download
-            elif not file_exists and song.download_status == "done":
-                db_song = session.get(Song, song.spotify_id)
-                if db_song:
-                    db_song.download_status = "pending"
-                    db_song.file_path = None
-                    db_song.updated_at = datetime.utcnow()
-                    fixed["marked_pending"] += 1
 
-    return fixed
+def shutdown():
+    """Stop the yt-dlp workers (called from main.py lifespan)."""
+    _pool.close()
 
 
 @router.post("/download/verify")
 async def verify_downloads():
     """Verify download state matches files on disk."""
-    fixed = _verify_download_state()
+    fixed = await run_db(reconcile_downloads, True)
     return {"status": "verified", "fixed": fixed}
 
 
 @router.post("/download")
 async def start_download():
-    """Start downloading audio for all pending songs."""
-    # First, verify state matches disk
-    _verify_download_state()
-
-    # Get pending songs - extract to dicts to avoid detached instance errors
-    with get_session() as session:
-        songs = session.exec(
-            select(Song).where(Song.download_status == "pending")
-        ).all()
-        # Extract data before session closes
-        song_data = [
-            {
-                "spotify_id": s.spotify_id,
-                "title": s.title,
-                "artist": s.artist,
-            }
-            for s in songs
-        ]
-
-    if not song_data:
+    """Queue downloads for all pending songs and start the runner."""
+    # First, verify state matches disk (a no-op if nothing changed)
+    await run_db(reconcile_downloads)
+
+    total = await run_db(jobs.enqueue, "download")
+
+    if not total:
         return {"status": "no_pending", "message": "No songs to download"}
 
-    # Reset state
+    # A running runner picks up the new jobs by itself
+    if not _runner_active():
+        _start_runner(total)
+
+    return {"status": "started", "total": total}
+
+
+def _runner_active() -> bool:
+    runner = _state.get("runner")
+    return runner is not None and not runner.done()
+
+
+def _start_runner(total: int):
+    """Reset progress and start draining the download queue in the background."""
     _state["progress"] = {
         "current": 0,
-        "total": len(song_data),
+        "total": total,
         "status": "downloading",
         "current_song": None,
         "success": 0,
         "failed": 0,
     }
     _state["active_downloads"] = 0
+    _publish_progress()
+    _state["runner"] = asyncio.create_task(_download_all())
 
-    # Start downloads in background
-    asyncio.create_task(_download_all(song_data))
 
-    return {"status": "started", "total": len(song_data)}
+async def resume(outstanding: int):
+    """Restart downloads left in the queue by a previous run (called from lifespan)."""
+    if outstanding and not _runner_active():
+        print(f"Resuming {outstanding} queued downloads")
+        _start_runner(outstanding)
 
 
-async def _download_all(songs: list[dict]):
-    """Download all songs with concurrency limit."""
-    tasks = [_download_song(song) for song in songs]
-    await asyncio.gather(*tasks)
-    _state["progress"]["status"] = "complete"
+async def _download_all():
+    """Drain the durable download queue, claiming only jobs a free slot can start now.
+
+    A lease runs from claim time, so nothing is claimed ahead of the
+    limiter: a job buffered behind slow downloads could outlive its lease
+    and be claimed (and downloaded) a second time.
+    """
+    running: set[asyncio.Task] = set()
+
+    try:
+        while True:
+            slots = await _limiter.acquire(settings.job_page_size)
+            try:
+                page = await run_db(jobs.claim, "download", slots)
+            except BaseException:
+                await _limiter.release(slots)
+                raise
+            if len(page) < slots:
+                await _limiter.release(slots - len(page))
+            for job in page:
+                task = asyncio.create_task(_download_claimed(job))
+                running.add(task)
+                task.add_done_callback(running.discard)
+            if page:
+                continue
+
+            if running:
+                # A finishing download may free capacity or schedule a retry
+                await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                continue
+
+            # Raises if the writes keep failing, ending the run with an error
+            await writes.drain()
+            wait = await run_db(jobs.seconds_until_next, "download")
+            if wait is None:
+                break
+            await asyncio.sleep(wait)
+    except Exception as e:
+        print(f"Download runner failed: {e}")
+        _finish(e)
+        return
+    finally:
+        for task in running:
+            task.cancel()
+        # Let cancelled downloads give their limiter slots back
+        await asyncio.gather(*running, return_exceptions=True)
+
+    _finish()
+
+
+def _finish(error: Exception | None = None):
+    """Mark the run finished and tell stream clients."""
+    if error is None:
+        _state["progress"]["status"] = "complete"
+        bus.publish("download", "complete", {
+            "success": _state["progress"]["success"],
+            "failed": _state["progress"]["failed"],
+        })
+    else:
+        _state["progress"]["status"] = f"error: {str(error)}"
+        bus.publish("download", "error", {"message": _state["progress"]["status"]})
+
+
+async def _download_claimed(job: dict):
+    """Download a claimed job, then give back the slot taken for it."""
+    try:
+        await _download_song(job)
+    finally:
+        await _limiter.release()
+
+
+def _record_result(job: dict, file_path: str | None, error: str | None) -> bool:
+    """Buffer a download outcome; True if the song is finished (done or out of retries)."""
+    if file_path is not None:
+        writes.set_status("download", job["spotify_id"], "done", file_path)
+        writes.complete(job["job_id"])
+        return True
+
+    writes.fail("download", job, error)
+    return job["attempts"] >= settings.job_max_attempts
 
 
 async def _download_song(song: dict):
@@ -124,122 +225,93 @@ async def _download_song(song: dict):
     title = song["title"]
     artist = song["artist"]
 
-    async with _semaphore:
-        _state["active_downloads"] += 1
-        _state["progress"]["current_song"] = {
-            "spotify_id": spotify_id,
-            "title": title,
-            "artist": artist,
-        }
-
-        # Update status to downloading
-        with get_session() as session:
-            db_song = session.get(Song, spotify_id)
-            if db_song:
-                db_song.download_status = "downloading"
-                db_song.updated_at = datetime.utcnow()
+    # The runner took a limiter slot for this song before claiming it
+    _state["active_downloads"] += 1
+    _state["progress"]["current_song"] = {
+        "spotify_id": spotify_id,
+        "title": title,
+        "artist": artist,
+    }
+
+    # Update status to downloading
+    writes.set_status("download", spotify_id, "downloading")
 
+    try:
+        # Build search query
+        search_query = f"ytsearch1:{artist} - {title}"
+        output_path = audio_path(spotify_id)
+
+        # Run yt-dlp on a persistent worker
+        started = time.monotonic()
         try:
-            # Build search query
-            search_query = f"ytsearch1:{artist} - {title}"
-            output_path = settings.audio_dir / f"{spotify_id}.mp3"
-
-            # Run yt-dlp
-            cmd = [
-                "yt-dlp",
-                "-x",  # Extract audio
-                "--audio-format", "mp3",
-                "--audio-quality", "5",  # Medium quality, smaller files
-                "-o", str(output_path).replace(".mp3", ".%(ext)s"),
-                "--no-playlist",
-                "--quiet",
-                "--no-warnings",
+            success, error = await _pool.run(
                 search_query,
-            ]
-
-            # Run in thread pool to not block
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
+                str(output_path.with_suffix(".%(ext)s")),
+                timeout=settings.download_timeout,
             )
-            _, stderr = await asyncio.wait_for(process.communicate(), timeout=120)
-
-            if process.returncode == 0 and output_path.exists():
-                # Success
-                with get_session() as session:
-                    db_song = session.get(Song, spotify_id)
-                    if db_song:
-                        db_song.download_status = "done"
-                        db_song.file_path = str(output_path)
-                        db_song.updated_at = datetime.utcnow()
-                _state["progress"]["success"] += 1
-            else:
-                # Failed
-                with get_session() as session:
-                    db_song = session.get(Song, spotify_id)
-                    if db_song:
-                        db_song.download_status = "failed"
-                        db_song.updated_at = datetime.utcnow()
-                _state["progress"]["failed"] += 1
-
         except asyncio.TimeoutError:
-            with get_session() as session:
-                db_song = session.get(Song, spotify_id)
-                if db_song:
-                    db_song.download_status = "failed"
-                    db_song.updated_at = datetime.utcnow()
-            _state["progress"]["failed"] += 1
-
+            raise
         except Exception as e:
-            with get_session() as session:
-                db_song = session.get(Song, spotify_id)
-                if db_song:
-                    db_song.download_status = "failed"
-                    db_song.updated_at = datetime.utcnow()
-            _state["progress"]["failed"] += 1
-
-        finally:
+            # Worker or pool errors are failed downloads too, for the limiter and metrics
+            success, error = False, str(e) or type(e).__name__
+        ok = success and output_path.exists()
+        elapsed = time.monotonic() - started
+        _limiter.record(elapsed, ok, congested=is_congestion(error))
+        stage_seconds.observe(elapsed, "download")
+        stage_items.inc("download", "ok" if ok else "error")
+
+        if ok:
+            # Success
+            _record_result(song, str(output_path), None)
+            _state["progress"]["success"] += 1
             _state["progress"]["current"] += 1
-            _state["active_downloads"] -= 1
+            _publish_progress()
+
+            # Pipeline mode: blocks while the embedder is behind
+            handoff = _state["handoff"]
+            if handoff is not None:
+                await handoff.put(spotify_id)
+        else:
+            # Failed
+            if error:
+                print(f"Download error for {spotify_id}: {error}")
+            await _record_failure(song, error or "yt-dlp produced no file")
+
+    except asyncio.TimeoutError:
+        _limiter.record(settings.download_timeout, False, congested=True)
+        stage_seconds.observe(settings.download_timeout, "download")
+        stage_items.inc("download", "timeout")
+        await _record_failure(song, "timed out")
+
+    except Exception as e:
+        await _record_failure(song, str(e))
+
+    finally:
+        _state["active_downloads"] -= 1
+
+
+async def _record_failure(song: dict, error: str):
+    """Queue a retry, or count the song as failed once retries run out."""
+    if _record_result(song, None, error):
+        _state["progress"]["failed"] += 1
+        _state["progress"]["current"] += 1
+        _publish_progress()
+
+
+def _publish_progress():
+    progress = _state["progress"]
+    bus.publish("download", "progress", {
+        "current": progress["current"],
+        "total": progress["total"],
+        "success": progress["success"],
+        "failed": progress["failed"],
+        "active": _state["active_downloads"],
+        "limit": _limiter.limit,
+        "song": progress["current_song"],
+    })
 
 
 @router.get("/download/stream")
-async def download_stream():
-    """SSE stream for download progress."""
-    async def event_generator():
-        last_current = -1
-
-        while True:
-            progress = _state["progress"]
-
-            # Send progress update if changed
-            if progress["current"] != last_current:
-                last_current = progress["current"]
-
-                yield {
-                    "event": "progress",
-                    "data": json.dumps({
-                        "current": progress["current"],
-                        "total": progress["total"],
-                        "success": progress["success"],
-                        "failed": progress["failed"],
-                        "active": _state["active_downloads"],
-                        "song": progress["current_song"],
-                    })
-                }
-
-            # Check if complete
-            if progress["status"] == "complete":
-                yield {
-                    "event": "complete",
-                    "data": json.dumps({
-                        "success": progress["success"],
-                        "failed": progress["failed"],
-                    })
-                }
-                break
-
-            await asyncio.sleep(0.3)
-
-    return EventSourceResponse(event_generator())
+async def download_stream(last_event_id: str | None = Header(default=None)):
+    """SSE stream for download progress (resumes from Last-Event-ID)."""
+    return stream("download", last_event_id)
@@ -1,16 +1,21 @@
 import asyncio
-import json
-from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
 
-from fastapi import APIRouter, HTTPException
-from sse_starlette.sse import EventSourceResponse
-from sqlmodel import select
+from fastapi import APIRouter, Header, HTTPException
 
+from .. import jobs
+from ..audio import load_clips
+from ..clap import clap_model_key, embed_clips, model_manager
 from ..config import settings
-from ..database import get_session
-from ..db import collection
-from ..models import Song
+from ..database import run_db
+from ..embed_workers import embed_files, make_pool
+from ..embedding_cache import embedding_cache, file_digest
+from ..events import bus, stream
+from ..metrics import Collected, stage_items, stage_seconds
+from ..reconcile import reconcile_embeddings
+from ..write_behind import writes
 
 router = APIRouter()
 
@@ -22,199 +27,374 @@ _state = {
         "status": "idle",
         "current_song": None,
     },
-    "model": None,  # CLAP model loaded at startup
+    "runner": None,  # background task draining the job queue
+    "process_pool": None,  # embedding worker processes when embed_workers > 1
+    "in_flight": 0,  # songs claimed and not yet stored or failed
 }
 
 # Thread pool for CPU-bound CLAP inference
 _executor = ThreadPoolExecutor(max_workers=1)
 
+# Separate pool so audio decode overlaps with inference
+_decode_executor = ThreadPoolExecutor(max_workers=settings.embed_decode_workers)
 
-def set_model(model):
-    """Set the CLAP model (called from main.py lifespan)."""
-    _state["model"] = model
 
+# Recorded with every vector so mixed-mode collections can be told apart,
+# and vectors from another model are found and re-embedded
+_VECTOR_METADATA = {
+    "clap_model": clap_model_key(),
+    **(
+        {"embed_mode": "windows", "embed_windows": settings.embed_window_count}
+        if settings.embed_mode == "windows" else {"embed_mode": "full"}
+    ),
+}
 
-def get_model():
-    """Get the CLAP model."""
-    return _state["model"]
 
+Collected("vibe_embeds_in_flight", "Songs claimed by the embed runner and not yet finished.",
+          lambda: _state["in_flight"])
 
-def _load_model():
-    """Load CLAP model if not already loaded."""
-    if _state["model"] is not None:
-        return True
 
-    try:
-        import laion_clap
-        print("Loading CLAP model...")
-        model = laion_clap.CLAP_Module(enable_fusion=False)
-        model.load_ckpt()  # Downloads checkpoint if needed (~600MB)
-        _state["model"] = model
-        print("CLAP model loaded successfully")
-        return True
-    except Exception as e:
-        print(f"Failed to load CLAP model: {e}")
-        return False
+def _process_pool():
+    """Worker processes for embed_workers > 1, started on first use."""
+    if _state["process_pool"] is None:
+        _state["process_pool"] = make_pool(settings.embed_workers, settings.embed_worker_threads)
+    return _state["process_pool"]
+
+
+def shutdown():
+    """Stop the embedding worker processes (called from main.py lifespan)."""
+    pool = _state["process_pool"]
+    if pool is not None:
+        _state["process_pool"] = None
+        pool.shutdown(wait=False, cancel_futures=True)
 
 
 @router.post("/embed")
 async def start_embed():
     """Start generating CLAP embeddings for downloaded songs."""
-    # Auto-load model if needed
-    if _state["model"] is None:
-        if not _load_model():
-            raise HTTPException(status_code=503, detail="Failed to load CLAP model")
-
-    # Get songs ready for embedding - extract to dicts to avoid DetachedInstanceError
-    with get_session() as session:
-        songs = session.exec(
-            select(Song).where(
-                Song.download_status == "done",
-                Song.embed_status == "pending"
-            )
-        ).all()
-        # Extract data before session closes
-        song_data = [
-            {
-                "spotify_id": s.spotify_id,
-                "title": s.title,
-                "artist": s.artist,
-                "album": s.album,
-                "album_art_url": s.album_art_url,
-                "spotify_link": s.spotify_link,
-                "file_path": s.file_path,
-            }
-            for s in songs
-        ]
-
-    if not song_data:
+    # Waits for a load already in progress, or starts one
+    if await model_manager.wait() is None:
+        raise HTTPException(status_code=503, detail="Failed to load CLAP model")
+
+    # Re-queue songs whose vectors went missing (a no-op if nothing changed)
+    await run_db(reconcile_embeddings)
+    total = await run_db(jobs.enqueue, "embed")
+
+    if not total:
         return {"status": "no_pending", "message": "No songs to embed"}
 
-    # Reset state
+    # A running runner picks up the new jobs by itself
+    if not _runner_active():
+        _start_runner(total)
+
+    return {"status": "started", "total": total}
+
+
+def _runner_active() -> bool:
+    runner = _state.get("runner")
+    return runner is not None and not runner.done()
+
+
+def _start_runner(total: int, feed=None):
+    """Reset progress and start draining the embed queue in the background."""
     _state["progress"] = {
         "current": 0,
-        "total": len(song_data),
+        "total": total,
         "status": "embedding",
         "current_song": None,
     }
+    _publish_progress()
+    _state["runner"] = asyncio.create_task(_embed_all(feed))
 
-    # Start embedding in background
-    asyncio.create_task(_embed_all(song_data))
 
-    return {"status": "started", "total": len(songs)}
+async def resume(outstanding: int):
+    """Restart embeds left in the queue by a previous run (called from lifespan)."""
+    if not outstanding or _runner_active():
+        return
+    if await model_manager.wait() is None:
+        print("Not resuming embeds: CLAP model unavailable")
+        return
+    print(f"Resuming {outstanding} queued embeds")
+    _start_runner(outstanding)
 
 
-async def _embed_all(songs: list[dict]):
-    """Embed all songs sequentially (GPU is the bottleneck)."""
-    loop = asyncio.get_event_loop()
+async def _embed_all(feed=None):
+    """Drain the durable embed queue in batches.
 
-    for song in songs:
-        spotify_id = song["spotify_id"]
-        _state["progress"]["current_song"] = {
-            "spotify_id": spotify_id,
-            "title": song["title"],
-            "artist": song["artist"],
-        }
+    With a `feed` (pipeline mode) an empty queue means "wait for the next
+    download" until the feed is closed.
+    """
+    batch_size = max(1, settings.embed_batch_size)
+
+    try:
+        if settings.embed_workers > 1:
+            # One loop per worker process keeps every process busy
+            await asyncio.gather(*(
+                _embed_in_processes(batch_size, feed) for _ in range(settings.embed_workers)
+            ))
+        else:
+            await _embed_in_thread(batch_size, feed)
+        # Raises if the writes keep failing, ending the run with an error
+        await writes.drain()
+    except Exception as e:
+        print(f"Embed runner failed: {e}")
+        _finish(e)
+        return
+    finally:
+        # Pipeline mode: downloaders must not wait on an embedder that is gone
+        if feed is not None:
+            feed.stop()
+
+    _finish()
+
+
+def _finish(error: Exception | None = None):
+    """Mark the run finished and tell stream clients."""
+    if error is None:
+        _state["progress"]["status"] = "complete"
+        bus.publish("embed", "complete", {"count": _state["progress"]["current"]})
+    else:
+        _state["progress"]["status"] = f"error: {str(error)}"
+        bus.publish("embed", "error", {"message": _state["progress"]["status"]})
+
+
+async def _embed_in_thread(batch_size: int, feed):
+    """Single inference thread, decoding the next batch while the current one runs."""
+    async def fetch():
+        batch = await _next_batch(batch_size, feed)
+        digests, embeddings = await _lookup_cached(batch)
+        # Only cache misses need decoding
+        clips = await _decode_batch([s for s, e in zip(batch, embeddings) if e is None])
+        return batch, digests, embeddings, clips
+
+    upcoming = asyncio.ensure_future(fetch())
+
+    while True:
+        batch, digests, embeddings, clips = await upcoming
+        if not batch:
+            break
+
+        # Prefetch: claim and decode of batch N+1 overlaps with inference of batch N
+        upcoming = asyncio.ensure_future(fetch())
+
+        await _run_batch(batch, partial(_embed_batch, batch, digests, embeddings, clips))
+
+
+async def _embed_in_processes(batch_size: int, feed):
+    """Feed batches to the worker processes, which decode and embed them."""
+    while batch := await _next_batch(batch_size, feed):
+        await _run_batch(batch, partial(_embed_batch_in_process, batch))
+
+
+async def _run_batch(batch: list[dict], embed):
+    """Mark a batch processing, run `embed` on it, then record failures and progress."""
+    ids = [song["spotify_id"] for song in batch]
+    _state["progress"]["current_song"] = {
+        "spotify_id": batch[-1]["spotify_id"],
+        "title": batch[-1]["title"],
+        "artist": batch[-1]["artist"],
+    }
+    for spotify_id in ids:
+        writes.set_status("embed", spotify_id, "processing")
 
-        # Update status to processing
-        with get_session() as session:
-            db_song = session.get(Song, spotify_id)
-            if db_song:
-                db_song.embed_status = "processing"
-                db_song.updated_at = datetime.utcnow()
+    _state["in_flight"] += len(batch)
+    try:
+        failed = await embed()
+    except Exception as e:
+        print(f"Embed error for batch starting at {ids[0]}: {e}")
+        failed = batch
+    finally:
+        _state["in_flight"] -= len(batch)
+    stage_items.inc("embed", "ok", amount=len(batch) - len(failed))
+    stage_items.inc("embed", "error", amount=len(failed))
+
+    finished = len(batch) - len(failed) + _record_failures(failed)
+    _state["progress"]["current"] += finished
+    _publish_progress()
+
+
+async def _next_batch(batch_size: int, feed) -> list[dict]:
+    """Claim the next batch of embed jobs; empty once there is nothing left to wait for."""
+    while True:
+        batch = await run_db(jobs.claim, "embed", batch_size)
+        if feed is not None:
+            feed.take(len(batch))
+        if batch:
+            return batch
+
+        if feed is not None and not feed.closed:
+            if feed.pending:
+                # Notices with nothing claimable are stale; drop them and re-check
+                feed.take(feed.pending)
+            else:
+                # Pipeline mode: wait for a download to land
+                await feed.wait()
+            continue
 
+        # Only retries waiting on backoff may be left; they are scheduled once written
+        await writes.drain()
+        wait = await run_db(jobs.seconds_until_next, "embed")
+        if wait is None:
+            return []
+        await asyncio.sleep(wait)
+
+
+def _record_failures(songs: list[dict]) -> int:
+    """Queue retries for failed embeds; returns how many are out of retries."""
+    for song in songs:
+        writes.fail("embed", song, "embedding failed")
+    return sum(1 for song in songs if song["attempts"] >= settings.job_max_attempts)
+
+
+async def _decode_batch(songs: list[dict]) -> list:
+    """Decode audio for a batch of songs in parallel on the decode pool."""
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(*(
+        loop.run_in_executor(_decode_executor, _decode, song["file_path"])
+        for song in songs
+    ))
+
+
+def _decode(file_path: str):
+    with stage_seconds.time("decode"):
+        clips = load_clips(file_path)
+    stage_items.inc("decode", "ok" if clips is not None else "error")
+    return clips
+
+
+async def _lookup_cached(songs: list[dict]) -> tuple[list[str | None], list]:
+    """Content digests for a batch, plus cached vectors (None where inference is needed)."""
+    if embedding_cache is None:
+        return [None] * len(songs), [None] * len(songs)
+
+    loop = asyncio.get_running_loop()
+    digests = await asyncio.gather(*(
+        loop.run_in_executor(_decode_executor, file_digest, song["file_path"])
+        for song in songs
+    ))
+    found = await loop.run_in_executor(
+        _decode_executor, embedding_cache.get_many, [d for d in digests if d is not None]
+    )
+    return digests, [found.get(digest) if digest is not None else None for digest in digests]
+
+
+async def _remember(digests: list[str | None], embeddings: list, todo: list[int]):
+    """Add freshly computed vectors to the content-hash cache."""
+    if embedding_cache is None:
+        return
+    fresh = {
+        digests[i]: embeddings[i]
+        for i in todo
+        if digests[i] is not None and embeddings[i] is not None
+    }
+    if fresh:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(_decode_executor, embedding_cache.put_many, fresh)
+
+
+async def _embed_batch(songs: list[dict], digests: list, embeddings: list, clips: list) -> list[dict]:
+    """Run CLAP on a batch's cache misses and write the results in bulk; returns failed songs.
+
+    `embeddings` holds cached vectors (None for misses); `clips` are the
+    decoded misses, in order.
+    """
+    loop = asyncio.get_running_loop()
+
+    todo = [i for i, vector in enumerate(embeddings) if vector is None]
+    embeddings = list(embeddings)
+    decoded = [(i, song_clips) for i, song_clips in zip(todo, clips) if song_clips is not None]
+    if decoded:
+        # Run CLAP inference in thread pool (CPU/GPU bound)
+        vectors = await loop.run_in_executor(
+            _executor,
+            _generate_embeddings,
+            [song_clips for _, song_clips in decoded]
+        )
+        for (i, _), vector in zip(decoded, vectors):
+            embeddings[i] = vector
+
+    await _remember(digests, embeddings, todo)
+    return _store_batch(songs, embeddings)
+
+
+async def _embed_batch_in_process(songs: list[dict]) -> list[dict]:
+    """Decode and embed a batch's cache misses on a worker process; returns failed songs."""
+    loop = asyncio.get_running_loop()
+    digests, embeddings = await _lookup_cached(songs)
+
+    todo = [i for i, vector in enumerate(embeddings) if vector is None]
+    if todo:
+        pool = _process_pool()
         try:
-            # Run CLAP inference in thread pool (CPU/GPU bound)
-            embedding = await loop.run_in_executor(
-                _executor,
-                _generate_embedding,
-                song["file_path"]
-            )
-
-            if embedding is not None:
-                # Store in ChromaDB
-                collection.upsert(
-                    ids=[spotify_id],
-                    embeddings=[embedding],
-                    metadatas=[{
-                        "title": song["title"],
-                        "artist": song["artist"],
-                        "album": song["album"],
-                        "album_art_url": song["album_art_url"],
-                        "spotify_link": song["spotify_link"],
-                    }]
+            with stage_seconds.time("embed_worker"):
+                vectors = await loop.run_in_executor(
+                    pool, embed_files, [songs[i]["file_path"] for i in todo]
                 )
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory); start fresh on the next batch
+            if _state["process_pool"] is pool:
+                _state["process_pool"] = None
+                pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        for i, vector in zip(todo, vectors):
+            embeddings[i] = vector
+
+    await _remember(digests, embeddings, todo)
+    return _store_batch(songs, embeddings)
+
+
+def _store_batch(songs: list[dict], embeddings: list) -> list[dict]:
+    """Buffer a batch's embeddings for the next bulk write; returns the songs that have none."""
+    failed = []
+    for song, embedding in zip(songs, embeddings):
+        if embedding is None:
+            failed.append(song)
+            continue
+        writes.store(song, embedding, {
+            "title": song["title"],
+            "artist": song["artist"],
+            "album": song["album"],
+            "album_art_url": song["album_art_url"],
+            "spotify_link": song["spotify_link"],
+            **_VECTOR_METADATA,
+        })
+    return failed
 
-                # Update SQLite
-                with get_session() as session:
-                    db_song = session.get(Song, spotify_id)
-                    if db_song:
-                        db_song.embed_status = "stored"
-                        db_song.updated_at = datetime.utcnow()
-            else:
-                with get_session() as session:
-                    db_song = session.get(Song, spotify_id)
-                    if db_song:
-                        db_song.embed_status = "failed"
-                        db_song.updated_at = datetime.utcnow()
 
-        except Exception as e:
-            print(f"Embed error for {spotify_id}: {e}")
-            with get_session() as session:
-                db_song = session.get(Song, spotify_id)
-                if db_song:
-                    db_song.embed_status = "failed"
-                    db_song.updated_at = datetime.utcnow()
+def _generate_embeddings(clips: list) -> list[list[float] | None]:
+    """Generate one CLAP embedding per song from its clips (runs in thread pool)."""
+    model = model_manager.get()
+    if model is None:
+        return [None] * len(clips)
+    with stage_seconds.time("clap_audio"):
+        return embed_clips(model, clips)
+
 
-        _state["progress"]["current"] += 1
+def _publish_progress():
+    progress = _state["progress"]
+    bus.publish("embed", "progress", {
+        "current": progress["current"],
+        "total": progress["total"],
+        "song": progress["current_song"],
+    })
 
-    _state["progress"]["status"] = "complete"
 
+@router.post("/embed/verify")
+async def verify_embeddings():
+    """Verify embed state matches the vectors in ChromaDB."""
+    fixed = await run_db(reconcile_embeddings, True)
+    return {"status": "verified", "fixed": fixed}
 
-def _generate_embedding(file_path: str) -> list[float] | None:
-    """Generate CLAP embedding for an audio file (runs in thread pool)."""
-    model = _state["model"]
-    if model is None:
-        return None
 
-    try:
-        # CLAP expects a list of file paths
-        embeddings = model.get_audio_embedding_from_filelist([file_path], use_tensor=False)
-        # Returns shape (1, 512), extract first row
-        return embeddings[0].tolist()
-    except Exception as e:
-        print(f"CLAP embedding error for {file_path}: {e}")
-        return None
+@router.get("/embed/cache")
+async def embed_cache_stats():
+    """Hit/miss counters for the content-hash embedding cache."""
+    if embedding_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **await run_db(embedding_cache.stats)}
 
 
 @router.get("/embed/stream")
-async def embed_stream():
-    """SSE stream for embedding progress."""
-    async def event_generator():
-        last_current = -1
-
-        while True:
-            progress = _state["progress"]
-
-            if progress["current"] != last_current:
-                last_current = progress["current"]
-
-                yield {
-                    "event": "progress",
-                    "data": json.dumps({
-                        "current": progress["current"],
-                        "total": progress["total"],
-                        "song": progress["current_song"],
-                    })
-                }
-
-            if progress["status"] == "complete":
-                yield {
-                    "event": "complete",
-                    "data": json.dumps({"count": progress["current"]})
-                }
-                break
-
-            await asyncio.sleep(0.3)
-
-    return EventSourceResponse(event_generator())
+async def embed_stream(last_event_id: str | None = Header(default=None)):
+    """SSE stream for embedding progress (resumes from Last-Event-ID)."""
+    return stream("embed", last_event_id)
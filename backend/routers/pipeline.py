@@ -0,0 +1,184 @@
+import asyncio
+import json
+
+from fastapi import APIRouter, Header, HTTPException
+from sse_starlette.sse import EventSourceResponse
+
+from .. import jobs
+from ..clap import model_manager
+from ..config import settings
+from ..database import run_db
+from ..events import TERMINAL, bus, parse_last_event_id
+from ..metrics import Collected
+from ..reconcile import reconcile_downloads, reconcile_embeddings
+from ..write_behind import writes
+from . import download, embed
+
+router = APIRouter()
+
+# Pipeline state
+_state = {
+    "status": "idle",
+    "runner": None,  # task closing the hand-off once downloads finish
+}
+
+
+class Handoff:
+    """Bounded hand-off from the download stage to the embed stage.
+
+    Each finished download queues its embed job and takes a slot; the
+    embedder frees slots as it claims jobs. When all slots are taken,
+    downloaders wait, so a slow model never piles up a backlog of files.
+    If the embedder stops, waiting downloaders are let go instead.
+    """
+
+    def __init__(self, maxsize: int):
+        self._slots = asyncio.Semaphore(maxsize)
+        self._ready = asyncio.Event()
+        self.closed = False
+        self.stopped = False  # the embedder is gone; nothing will free slots
+        self.pending = 0
+
+    async def put(self, spotify_id: str):
+        """Queue the embed job for a downloaded song, waiting for a free slot.
+
+        The job goes out with the next write-behind flush, in the same
+        transaction as the song's "done" status; the embedder is woken once
+        it is written. Once the embedder has stopped this returns at once;
+        the song stays downloaded and the next embed run queues it.
+        """
+        if self.stopped:
+            return
+        await self._slots.acquire()
+        if self.stopped:
+            # Pass the wake-up on to the next waiting downloader
+            self._slots.release()
+            return
+        writes.enqueue("embed", spotify_id).add_done_callback(self._queued)
+
+    def _queued(self, _future: asyncio.Future):
+        embed._state["progress"]["total"] += 1
+        embed._publish_progress()
+        self.pending += 1
+        self._ready.set()
+
+    def take(self, n: int):
+        """Free slots for up to `n` jobs the embedder has claimed."""
+        n = min(n, self.pending)
+        self.pending -= n
+        for _ in range(n):
+            self._slots.release()
+        if self.pending == 0 and not self.closed:
+            self._ready.clear()
+
+    def close(self):
+        """No more downloads are coming; wake the embedder so it can drain and stop."""
+        self.closed = True
+        self._ready.set()
+
+    def stop(self):
+        """The embedder exited; release downloaders blocked on a slot."""
+        self.stopped = True
+        self._slots.release()
+
+    async def wait(self):
+        await self._ready.wait()
+
+
+Collected("vibe_pipeline_handoff_pending", "Downloaded songs waiting for the embedder in pipeline mode.",
+          lambda: handoff.pending if (handoff := download._state["handoff"]) is not None else 0)
+
+
+@router.post("/pipeline")
+async def start_pipeline():
+    """Download pending songs and embed each one as soon as it lands."""
+    if download._runner_active() or embed._runner_active():
+        raise HTTPException(status_code=409, detail="Download or embed already running")
+
+    # The model has to be ready before the first download finishes
+    if await model_manager.wait() is None:
+        raise HTTPException(status_code=503, detail="Failed to load CLAP model")
+
+    await run_db(reconcile_downloads)
+    await run_db(reconcile_embeddings)
+
+    total = await run_db(jobs.enqueue, "download")
+    # Songs already on disk but not yet embedded go first
+    backlog = await run_db(jobs.enqueue, "embed")
+
+    if not total and not backlog:
+        return {"status": "no_pending", "message": "No songs to download or embed"}
+
+    handoff = Handoff(settings.pipeline_queue_size)
+    download._state["handoff"] = handoff
+    download._start_runner(total)
+    embed._start_runner(backlog, feed=handoff)
+    _state["status"] = "running"
+    bus.publish("pipeline", "started", {"download_total": total, "embed_total": backlog})
+    _state["runner"] = asyncio.create_task(_close_after_downloads(handoff))
+
+    return {"status": "started", "download_total": total, "embed_total": backlog}
+
+
+async def _close_after_downloads(handoff: Handoff):
+    """Close the hand-off once the download runner is done, then wait for the embedder.
+
+    If the embedder ends first (it failed or was cancelled), nothing would
+    take what downloads hand off, so the download runner is stopped too.
+    """
+    downloads, embeds = download._state["runner"], embed._state["runner"]
+    try:
+        try:
+            await asyncio.wait({downloads, embeds}, return_when=asyncio.FIRST_COMPLETED)
+            if not downloads.done():
+                downloads.cancel()
+                await asyncio.gather(downloads, return_exceptions=True)
+                reason = embed._state["progress"]["status"]
+                download._finish(RuntimeError(f"stopped because the embed stage ended ({reason})"))
+        finally:
+            download._state["handoff"] = None
+            handoff.close()
+        await embeds
+    finally:
+        errors = [
+            stage._state["progress"]["status"]
+            for stage in (download, embed)
+            if stage._state["progress"]["status"].startswith("error")
+        ]
+        if errors:
+            _state["status"] = errors[0]
+            bus.publish("pipeline", "error", {"message": errors[0]})
+        else:
+            _state["status"] = "complete"
+            bus.publish("pipeline", "complete", {
+                "downloaded": download._state["progress"]["success"],
+                "download_failed": download._state["progress"]["failed"],
+                "embedded": embed._state["progress"]["current"],
+            })
+
+
+@router.get("/pipeline/stream")
+async def pipeline_stream(last_event_id: str | None = Header(default=None)):
+    """SSE stream with download and embed progress side by side (resumes from Last-Event-ID)."""
+    async def event_generator():
+        stages = {}
+        for topic in ("download", "embed"):
+            latest = bus.latest(topic, "progress")
+            stages[topic] = latest.data if latest is not None else {}
+
+        subscription = bus.subscribe(
+            "download", "embed", "pipeline", last_event_id=parse_last_event_id(last_event_id)
+        )
+        with subscription:
+            while True:
+                event = await subscription.get()
+
+                if event.topic in stages and event.event == "progress":
+                    stages[event.topic] = event.data
+                    yield {"id": str(event.id), "event": "progress", "data": json.dumps(stages)}
+
+                elif event.topic == "pipeline" and event.event in TERMINAL:
+                    yield event.sse()
+                    break
+
+    return EventSourceResponse(event_generator())
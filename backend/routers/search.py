@@ -1,78 +1,211 @@
-from fastapi import APIRouter, HTTPException
+import asyncio
+import hashlib
+import time
+from typing import Optional
+
+import numpy as np
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse
 from sqlmodel import select, func
 
-from ..database import get_session
-from ..db import collection
+from ..config import settings
+from ..database import get_session, run_db
+from ..index import get_index
+from ..metrics import search_seconds, stage_items, stage_seconds
 from ..models import Song, SearchRequest, SearchResponse, SearchResult, LibraryResponse, LibraryStats, SongResponse
-from .embed import get_model, _load_model
+from ..text_cache import normalize_query, text_cache
+from ..clap import model_manager
 
 router = APIRouter()
 
 
-@router.post("/search", response_model=SearchResponse)
-async def search(request: SearchRequest):
-    """Search for songs by vibe/text query using CLAP embeddings."""
-    # Ensure model is loaded
-    model = get_model()
+def _encode_queries(model, queries: list[str]) -> np.ndarray:
+    """Encode query texts with CLAP, serving repeats from the text cache."""
+    vectors = [text_cache.get(query) for query in queries]
+
+    # Encode every distinct cache miss in a single model call
+    missing = list(dict.fromkeys(
+        normalize_query(query) for query, vector in zip(queries, vectors) if vector is None
+    ))
+    if missing:
+        with stage_seconds.time("clap_text"):
+            encoded = model.get_text_embedding(missing, use_tensor=False)
+        stage_items.inc("clap_text", "ok", amount=len(missing))
+        fresh = dict(zip(missing, encoded))
+        for text, vector in fresh.items():
+            text_cache.put(text, vector)
+        vectors = [
+            vector if vector is not None else fresh[normalize_query(query)]
+            for query, vector in zip(queries, vectors)
+        ]
+
+    return np.stack(vectors)
+
+
+async def _require_model():
+    """Wait (off the loop) for the CLAP model, starting a load if none is running."""
+    model = await model_manager.wait(timeout=settings.model_wait_timeout)
     if model is None:
-        if not _load_model():
-            raise HTTPException(status_code=503, detail="CLAP model not available")
-        model = get_model()
+        if model_manager.state == "loading":
+            raise HTTPException(status_code=503, detail="CLAP model still loading",
+                                headers={"Retry-After": "5"})
+        raise HTTPException(status_code=503, detail="CLAP model not available")
+    return model
+
+
+def _search_many(model, requests: list[SearchRequest]) -> list[SearchResponse]:
+    """Encode all queries in one call and score them against the index together."""
+    index = get_index()
 
     # Check if we have any embeddings
-    if collection.count() == 0:
-        return SearchResponse(results=[])
+    if index.count() == 0:
+        return [SearchResponse(results=[]) for _ in requests]
+
+    # Encode text queries with CLAP (cached)
+    started = time.perf_counter()
+    text_embeddings = _encode_queries(model, [request.query for request in requests])
+    encoded = time.perf_counter()
+
+    # One top-k pass at the largest requested size, trimmed per request below
+    n_results = max(request.n_results for request in requests)
+    all_hits = index.query(text_embeddings, n_results)
+    queried = time.perf_counter()
+
+    responses = [
+        SearchResponse(results=[
+            SearchResult(
+                spotify_id=spotify_id,
+                title=metadata.get("title", ""),
+                artist=metadata.get("artist", ""),
+                album=metadata.get("album", ""),
+                album_art_url=metadata.get("album_art_url", ""),
+                spotify_link=metadata.get("spotify_link", ""),
+                similarity_score=round(similarity, 4),
+            )
+            for spotify_id, similarity, metadata in hits[:request.n_results]
+        ])
+        for request, hits in zip(requests, all_hits)
+    ]
+
+    search_seconds.observe(encoded - started, "encode")
+    search_seconds.observe(queried - encoded, "query")
+    search_seconds.observe(time.perf_counter() - queried, "hydrate")
+    stage_items.inc("search", "ok", amount=len(requests))
+    return responses
+
+
+async def _run_search(model, requests: list[SearchRequest]) -> list[SearchResponse]:
+    """Text encoding is CPU-bound, so run the search off the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, _search_many, model, requests)
+
+
+@router.post("/search", response_model=SearchResponse)
+async def search(request: SearchRequest):
+    """Search for songs by vibe/text query using CLAP embeddings."""
+    model = await _require_model()
 
     try:
-        # Encode text query with CLAP
-        text_embedding = model.get_text_embedding([request.query], use_tensor=False)
-        query_vector = text_embedding[0].tolist()
-
-        # Query ChromaDB for nearest neighbors
-        results = collection.query(
-            query_embeddings=[query_vector],
-            n_results=min(request.n_results, collection.count()),
-            include=["metadatas", "distances"]
+        return (await _run_search(model, [request]))[0]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Search error: {str(e)}")
+
+
+@router.post("/search/batch", response_model=list[SearchResponse])
+async def search_batch(requests: list[SearchRequest]):
+    """Run many vibe queries in one call; responses are in request order."""
+    if not requests:
+        return []
+    if len(requests) > settings.search_batch_max:
+        raise HTTPException(
+            status_code=422,
+            detail=f"At most {settings.search_batch_max} queries per batch, got {len(requests)}",
         )
 
-        # Format results
-        search_results = []
-        if results["ids"] and results["ids"][0]:
-            for i, spotify_id in enumerate(results["ids"][0]):
-                metadata = results["metadatas"][0][i]
-                # ChromaDB returns distance, convert to similarity (1 - distance for cosine)
-                distance = results["distances"][0][i]
-                similarity = 1 - distance  # Cosine distance to similarity
-
-                search_results.append(SearchResult(
-                    spotify_id=spotify_id,
-                    title=metadata.get("title", ""),
-                    artist=metadata.get("artist", ""),
-                    album=metadata.get("album", ""),
-                    album_art_url=metadata.get("album_art_url", ""),
-                    spotify_link=metadata.get("spotify_link", ""),
-                    similarity_score=round(similarity, 4),
-                ))
-
-        return SearchResponse(results=search_results)
+    model = await _require_model()
 
+    try:
+        return await _run_search(model, requests)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search error: {str(e)}")
 
 
-@router.get("/library", response_model=LibraryResponse)
-async def get_library():
-    """Get all songs and their current pipeline status."""
+@router.get("/search/cache")
+async def search_cache_stats():
+    """Hit/miss counters for the text-embedding cache."""
+    return text_cache.stats()
+
+
+def _library_stats() -> tuple[LibraryStats, str]:
+    """Stats plus a version tag for the whole library, from one GROUP BY query."""
     with get_session() as session:
-        # Get all songs
-        songs = session.exec(select(Song)).all()
+        rows = session.exec(
+            select(
+                Song.download_status,
+                Song.embed_status,
+                func.count(),
+                func.max(Song.updated_at),
+            ).group_by(Song.download_status, Song.embed_status)
+        ).all()
 
-        # Calculate stats
-        total = len(songs)
-        downloaded = sum(1 for s in songs if s.download_status == "done")
-        embedded = sum(1 for s in songs if s.embed_status == "stored")
+    total = sum(count for _, _, count, _ in rows)
+    downloaded = sum(count for download_status, _, count, _ in rows if download_status == "done")
+    embedded = sum(count for _, embed_status, count, _ in rows if embed_status == "stored")
 
-        return LibraryResponse(
-            songs=[SongResponse.model_validate(s) for s in songs],
-            stats=LibraryStats(total=total, downloaded=downloaded, embedded=embedded)
-        )
+    # Any insert or status/metadata change moves a count or max(updated_at)
+    version = hashlib.sha1(repr(sorted(rows, key=repr)).encode()).hexdigest()
+    return LibraryStats(total=total, downloaded=downloaded, embedded=embedded), version
+
+
+def _library_page(
+    cursor: Optional[str],
+    limit: int,
+    download_status: Optional[str],
+    embed_status: Optional[str],
+    artist: Optional[str],
+) -> tuple[list[SongResponse], Optional[str]]:
+    """One keyset page of songs ordered by spotify_id, plus the next cursor."""
+    query = select(Song).order_by(Song.spotify_id).limit(limit + 1)
+    if cursor:
+        query = query.where(Song.spotify_id > cursor)
+    if download_status:
+        query = query.where(Song.download_status == download_status)
+    if embed_status:
+        query = query.where(Song.embed_status == embed_status)
+    if artist:
+        query = query.where(Song.artist.contains(artist))
+
+    with get_session() as session:
+        songs = session.exec(query).all()
+
+        next_cursor = None
+        if len(songs) > limit:
+            songs = songs[:limit]
+            next_cursor = songs[-1].spotify_id
+
+        return [SongResponse.model_validate(s) for s in songs], next_cursor
+
+
+@router.get("/library", response_model=LibraryResponse)
+async def get_library(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    download_status: Optional[str] = None,
+    embed_status: Optional[str] = None,
+    artist: Optional[str] = None,
+):
+    """Get a page of songs and their current pipeline status."""
+    stats, version = await run_db(_library_stats)
+
+    # Cheap revalidation for dashboards that poll
+    etag = '"' + hashlib.sha1(f"{version}|{request.url.query}".encode()).hexdigest() + '"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    songs, next_cursor = await run_db(
+        _library_page, cursor, limit, download_status, embed_status, artist
+    )
+    library = LibraryResponse(songs=songs, stats=stats, next_cursor=next_cursor)
+
+    return JSONResponse(library.model_dump(), headers={"ETag": etag})
@@ -1,19 +1,21 @@
 import asyncio
-import json
 from datetime import datetime
 
-from fastapi import APIRouter, HTTPException, Query
-from sse_starlette.sse import EventSourceResponse
-import spotipy
+from fastapi import APIRouter, Header, HTTPException, Query
 from spotipy.oauth2 import SpotifyOAuth
-from sqlmodel import select
+from sqlmodel import insert, select, update
 
 from ..config import settings
-from ..database import get_session
-from ..models import Song, SyncRequest
+from ..database import get_session, run_db
+from ..events import bus, stream
+from ..models import Song, SyncRequest, SyncSource
+from ..spotify import SpotifyFetcher, make_client
 
 router = APIRouter()
 
+# SyncSource id for the user's liked songs
+LIKED_SOURCE_ID = "liked"
+
 # In-memory state for auth and sync progress
 _state = {
     "access_token": None,
@@ -64,201 +66,300 @@ async def start_sync(request: SyncRequest):
 
     # Reset progress
     _state["progress"] = {"current": 0, "total": 0, "status": "syncing", "latest_song": None}
+    _publish_progress()
 
     # Start sync in background
-    asyncio.create_task(_sync_playlist(request.playlist_id))
+    asyncio.create_task(_sync_playlist(request.playlist_id, full=request.full))
 
     return {"status": "started", "playlist_id": request.playlist_id}
 
 
-async def _sync_playlist(playlist_id: str):
-    """Fetch all tracks from a playlist and save to database."""
+def _track_row(item: dict) -> dict | None:
+    """Song column values for one Spotify track item (None for local files)."""
+    track = item["track"]
+    if not track or not track["id"]:  # Skip local files
+        return None
+
+    # Get album art (largest available)
+    album_art_url = ""
+    if track["album"]["images"]:
+        album_art_url = track["album"]["images"][0]["url"]
+
+    return {
+        "spotify_id": track["id"],
+        "title": track["name"],
+        "artist": ", ".join(a["name"] for a in track["artists"]),
+        "album": track["album"]["name"],
+        "uri": track["uri"],
+        # Parse added_at timestamp
+        "added_at": datetime.fromisoformat(item["added_at"].replace("Z", "+00:00")),
+        "album_art_url": album_art_url,
+        "spotify_link": f"https://open.spotify.com/track/{track['id']}",
+    }
+
+
+def _ingest_tracks(items: list[dict]) -> int:
+    """Bulk upsert Spotify track items: one IN lookup, one insert, one update."""
+    # Later duplicates of the same track win
+    rows = {}
+    for item in items:
+        row = _track_row(item)
+        if row is not None:
+            rows[row["spotify_id"]] = row
+
+    if not rows:
+        return 0
+
+    now = datetime.utcnow()
+
+    with get_session() as session:
+        existing = {
+            song_id: (title, artist, album, album_art_url)
+            for song_id, title, artist, album, album_art_url in session.exec(
+                select(Song.spotify_id, Song.title, Song.artist, Song.album, Song.album_art_url)
+                .where(Song.spotify_id.in_(list(rows)))
+            ).all()
+        }
+
+        new_rows = [
+            {
+                **row,
+                "download_status": "pending",
+                "embed_status": "pending",
+                "file_path": None,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for song_id, row in rows.items()
+            if song_id not in existing
+        ]
+        changed_rows = [
+            {
+                "spotify_id": song_id,
+                "title": row["title"],
+                "artist": row["artist"],
+                "album": row["album"],
+                "album_art_url": row["album_art_url"],
+                "updated_at": now,
+            }
+            for song_id, row in rows.items()
+            if song_id in existing
+            and existing[song_id] != (row["title"], row["artist"], row["album"], row["album_art_url"])
+        ]
+
+        if new_rows:
+            session.execute(insert(Song), new_rows)
+        if changed_rows:
+            # Bulk UPDATE by primary key
+            session.execute(update(Song), changed_rows)
+
+    if new_rows:
+        latest = new_rows[-1]
+        _state["progress"]["latest_song"] = {"title": latest["title"], "artist": latest["artist"]}
+
+    return len(rows)
+
+
+def _added_at(item: dict) -> datetime:
+    """added_at of a track item as naive UTC, as SQLite hands it back."""
+    return datetime.fromisoformat(item["added_at"].replace("Z", "+00:00")).replace(tzinfo=None)
+
+
+def _newest_added_at(items: list[dict]) -> datetime | None:
+    return max((_added_at(item) for item in items if item.get("added_at")), default=None)
+
+
+def _load_sync_source(source_id: str) -> dict | None:
+    """Snapshot and watermark from the last successful sync of a source."""
+    with get_session() as session:
+        source = session.get(SyncSource, source_id)
+        if source is None:
+            return None
+        return {
+            "snapshot_id": source.snapshot_id,
+            "added_at_watermark": source.added_at_watermark,
+            "track_count": source.track_count,
+        }
+
+
+def _save_sync_source(
+    source_id: str,
+    snapshot_id: str | None,
+    added_at_watermark: datetime | None,
+    track_count: int,
+):
+    """Remember where a successful sync left off."""
+    with get_session() as session:
+        source = session.get(SyncSource, source_id) or SyncSource(source_id=source_id)
+        source.snapshot_id = snapshot_id
+        if added_at_watermark is not None:
+            source.added_at_watermark = added_at_watermark
+        source.track_count = track_count
+        source.synced_at = datetime.utcnow()
+        session.add(source)
+
+
+async def _ingest_pages(pages) -> datetime | None:
+    """Save fetched pages in bulk batches; returns the newest added_at seen."""
+    buffered = []
+    newest = None
+    async for _, results in pages:
+        buffered.extend(results["items"])
+        page_newest = _newest_added_at(results["items"])
+        if page_newest is not None and (newest is None or page_newest > newest):
+            newest = page_newest
+        if len(buffered) >= settings.sync_ingest_batch:
+            _state["progress"]["current"] += await run_db(_ingest_tracks, buffered)
+            _publish_progress()
+            buffered = []
+
+    if buffered:
+        _state["progress"]["current"] += await run_db(_ingest_tracks, buffered)
+        _publish_progress()
+
+    return newest
+
+
+def _reaches_watermark(items: list[dict], watermark: datetime) -> bool:
+    """True once a newest-first page gets back to tracks we already have."""
+    return not items or _added_at(items[-1]) <= watermark
+
+
+async def _until_watermark(pages, watermark: datetime, start: int, limit: int):
+    """Pass pages through until everything newer than the watermark has arrived.
+
+    Pages complete out of order, so stop only once every page before the
+    first one that reaches the watermark is in; the rest are cancelled.
+    """
+    stop_at = None
+    seen = set()
+    try:
+        async for offset, results in pages:
+            seen.add(offset)
+            yield offset, results
+            if _reaches_watermark(results["items"], watermark):
+                stop_at = offset if stop_at is None else min(stop_at, offset)
+            if stop_at is not None and seen.issuperset(range(start, stop_at, limit)):
+                return
+    finally:
+        await pages.aclose()
+
+
+async def _sync_playlist(playlist_id: str, full: bool = False):
+    """Fetch a playlist's tracks and save to database, skipping it if unchanged."""
     try:
-        sp = spotipy.Spotify(auth=_state["access_token"])
+        fetcher = SpotifyFetcher(make_client(_state["access_token"]))
+        sp = fetcher.client
 
-        # Get playlist info first to get total
-        playlist = sp.playlist(playlist_id, fields="tracks.total,name")
+        # Get playlist info first to get total and version
+        playlist = await fetcher.call(
+            sp.playlist, playlist_id, fields="snapshot_id,tracks.total,name"
+        )
         total = playlist["tracks"]["total"]
+        snapshot_id = playlist.get("snapshot_id")
         _state["progress"]["total"] = total
-
-        # Paginate through tracks
-        offset = 0
-        limit = 50
-        synced_count = 0
-
-        while offset < total:
-            results = sp.playlist_tracks(
-                playlist_id,
-                offset=offset,
-                limit=limit,
-                fields="items(added_at,track(id,name,artists,album(name,images),uri))"
-            )
-
-            with get_session() as session:
-                for item in results["items"]:
-                    track = item["track"]
-                    if not track or not track["id"]:  # Skip local files
-                        continue
-
-                    # Check if song already exists
-                    existing = session.get(Song, track["id"])
-                    if existing:
-                        synced_count += 1
-                        _state["progress"]["current"] = synced_count
-                        continue
-
-                    # Get album art (largest available)
-                    album_art_url = ""
-                    if track["album"]["images"]:
-                        album_art_url = track["album"]["images"][0]["url"]
-
-                    # Parse added_at timestamp
-                    added_at = datetime.fromisoformat(item["added_at"].replace("Z", "+00:00"))
-
-                    # Create new song record
-                    song = Song(
-                        spotify_id=track["id"],
-                        title=track["name"],
-                        artist=", ".join(a["name"] for a in track["artists"]),
-                        album=track["album"]["name"],
-                        uri=track["uri"],
-                        added_at=added_at,
-                        album_art_url=album_art_url,
-                        spotify_link=f"https://open.spotify.com/track/{track['id']}",
-                    )
-
-                    session.add(song)
-                    synced_count += 1
-
-                    _state["progress"]["current"] = synced_count
-                    _state["progress"]["latest_song"] = {"title": song.title, "artist": song.artist}
-
-            offset += limit
-            await asyncio.sleep(0.1)  # Small delay to avoid rate limits
-
-        _state["progress"]["status"] = "complete"
+        _publish_progress()
+
+        # Same snapshot as the last successful sync: nothing to fetch
+        previous = await run_db(_load_sync_source, playlist_id)
+        if not full and previous and snapshot_id and previous["snapshot_id"] == snapshot_id:
+            _state["progress"]["current"] = total
+            _publish_progress()
+            _finish()
+            return
+
+        # Fetch pages concurrently, saving them in bulk as they arrive
+        newest = await _ingest_pages(fetcher.fetch_pages(
+            sp.playlist_tracks,
+            total,
+            playlist_id,
+            limit=50,
+            fields="items(added_at,track(id,name,artists,album(name,images),uri))",
+        ))
+
+        await run_db(_save_sync_source, playlist_id, snapshot_id, newest, total)
+        _finish()
 
     except Exception as e:
-        _state["progress"]["status"] = f"error: {str(e)}"
+        _finish(e)
 
 
 @router.post("/sync/liked")
-async def start_sync_liked():
-    """Start syncing user's liked songs."""
+async def start_sync_liked(full: bool = False):
+    """Start syncing user's liked songs (only new ones unless full=true)."""
     if not _state["access_token"]:
         raise HTTPException(status_code=401, detail="Not authenticated with Spotify")
 
     # Reset progress
     _state["progress"] = {"current": 0, "total": 0, "status": "syncing", "latest_song": None}
+    _publish_progress()
 
     # Start sync in background
-    asyncio.create_task(_sync_liked_songs())
+    asyncio.create_task(_sync_liked_songs(full=full))
 
     return {"status": "started", "source": "liked_songs"}
 
 
-async def _sync_liked_songs():
-    """Fetch all liked songs and save to database."""
+async def _sync_liked_songs(full: bool = False):
+    """Fetch liked songs newer than the last sync and save to database."""
     try:
-        sp = spotipy.Spotify(auth=_state["access_token"])
+        fetcher = SpotifyFetcher(make_client(_state["access_token"]))
+        sp = fetcher.client
+        limit = 50
+
+        previous = await run_db(_load_sync_source, LIKED_SOURCE_ID)
+        watermark = None if full or previous is None else previous["added_at_watermark"]
 
-        # Get total count first
-        initial = sp.current_user_saved_tracks(limit=1)
-        total = initial["total"]
+        # First page also tells us the total; liked songs come newest first
+        first = await fetcher.call(sp.current_user_saved_tracks, limit=limit)
+        total = first["total"]
         _state["progress"]["total"] = total
 
-        # Paginate through liked songs
-        offset = 0
-        limit = 50
-        synced_count = 0
-
-        while offset < total:
-            results = sp.current_user_saved_tracks(offset=offset, limit=limit)
-
-            with get_session() as session:
-                for item in results["items"]:
-                    track = item["track"]
-                    if not track or not track["id"]:  # Skip local files
-                        continue
-
-                    # Check if song already exists
-                    existing = session.get(Song, track["id"])
-                    if existing:
-                        synced_count += 1
-                        _state["progress"]["current"] = synced_count
-                        continue
-
-                    # Get album art (largest available)
-                    album_art_url = ""
-                    if track["album"]["images"]:
-                        album_art_url = track["album"]["images"][0]["url"]
-
-                    # Parse added_at timestamp
-                    added_at = datetime.fromisoformat(item["added_at"].replace("Z", "+00:00"))
-
-                    # Create new song record
-                    song = Song(
-                        spotify_id=track["id"],
-                        title=track["name"],
-                        artist=", ".join(a["name"] for a in track["artists"]),
-                        album=track["album"]["name"],
-                        uri=track["uri"],
-                        added_at=added_at,
-                        album_art_url=album_art_url,
-                        spotify_link=f"https://open.spotify.com/track/{track['id']}",
-                    )
-
-                    session.add(song)
-                    synced_count += 1
-
-                    _state["progress"]["current"] = synced_count
-                    _state["progress"]["latest_song"] = {"title": song.title, "artist": song.artist}
-
-            offset += limit
-            await asyncio.sleep(0.1)  # Small delay to avoid rate limits
+        _state["progress"]["current"] = await run_db(_ingest_tracks, first["items"])
+        _publish_progress()
+        newest = _newest_added_at(first["items"])
 
-        _state["progress"]["status"] = "complete"
+        if watermark is None or not _reaches_watermark(first["items"], watermark):
+            # Fetch the remaining pages concurrently, saving them in bulk
+            pages = fetcher.fetch_pages(
+                sp.current_user_saved_tracks, total, limit=limit, start=limit
+            )
+            if watermark is not None:
+                pages = _until_watermark(pages, watermark, start=limit, limit=limit)
+            await _ingest_pages(pages)
+
+        if watermark is not None:
+            # Stopped early at known tracks
+            _state["progress"]["total"] = _state["progress"]["current"]
+            _publish_progress()
+
+        await run_db(_save_sync_source, LIKED_SOURCE_ID, None, newest, total)
+        _finish()
 
     except Exception as e:
-        _state["progress"]["status"] = f"error: {str(e)}"
+        _finish(e)
+
+
+def _publish_progress():
+    progress = _state["progress"]
+    bus.publish("sync", "progress", {
+        "current": progress["current"],
+        "total": progress["total"],
+        "song": progress["latest_song"],
+    })
+
+
+def _finish(error: Exception | None = None):
+    """Mark the sync finished and tell stream clients."""
+    if error is None:
+        _state["progress"]["status"] = "complete"
+        bus.publish("sync", "complete", {"count": _state["progress"]["current"]})
+    else:
+        _state["progress"]["status"] = f"error: {str(error)}"
+        bus.publish("sync", "error", {"message": _state["progress"]["status"]})
 
 
 @router.get("/sync/stream")
-async def sync_stream():
-    """SSE stream for sync progress."""
-    async def event_generator():
-        last_current = -1
-
-        while True:
-            progress = _state["progress"]
-
-            # Send progress update if changed
-            if progress["current"] != last_current:
-                last_current = progress["current"]
-
-                yield {
-                    "event": "progress",
-                    "data": json.dumps({
-                        "current": progress["current"],
-                        "total": progress["total"],
-                        "song": progress["latest_song"]
-                    })
-                }
-
-            # Check if complete or error
-            if progress["status"] == "complete":
-                yield {
-                    "event": "complete",
-                    "data": json.dumps({"count": progress["current"]})
-                }
-                break
-            elif progress["status"].startswith("error"):
-                yield {
-                    "event": "error",
-                    "data": json.dumps({"message": progress["status"]})
-                }
-                break
-
-            await asyncio.sleep(0.2)
-
-    return EventSourceResponse(event_generator())
+async def sync_stream(last_event_id: str | None = Header(default=None)):
+    """SSE stream for sync progress (resumes from Last-Event-ID)."""
+    return stream("sync", last_event_id)
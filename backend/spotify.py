@@ -0,0 +1,98 @@
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import requests
+import spotipy
+from spotipy.exceptions import SpotifyException
+
+from .config import settings
+
+# One pooled HTTP session reused by every Spotify client
+_http = requests.Session()
+_http.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=settings.spotify_concurrency))
+
+# spotipy is blocking, so its calls run here instead of on the event loop
+_executor = ThreadPoolExecutor(
+    max_workers=settings.spotify_concurrency,
+    thread_name_prefix="spotify",
+)
+
+
+def make_client(access_token: str) -> spotipy.Spotify:
+    """Spotify client on the shared session; retries are handled by SpotifyFetcher."""
+    return spotipy.Spotify(auth=access_token, requests_session=_http)
+
+
+def _retry_after(error: SpotifyException) -> float | None:
+    """Seconds from a 429 Retry-After header, if Spotify sent one."""
+    value = (error.headers or {}).get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class SpotifyFetcher:
+    """Runs spotipy calls off the loop with bounded parallelism and adaptive backoff.
+
+    A 429 pauses every in-flight caller until Retry-After has passed. Without a
+    header the pause grows exponentially (with jitter) and decays again as calls
+    succeed.
+    """
+
+    def __init__(self, client, concurrency: int | None = None):
+        self.client = client
+        self._semaphore = asyncio.Semaphore(concurrency or settings.spotify_concurrency)
+        self._resume_at = 0.0
+        self._backoff = settings.spotify_backoff_base
+
+    async def call(self, method, *args, **kwargs):
+        """Call a client method, retrying on 429 and 5xx responses."""
+        loop = asyncio.get_running_loop()
+
+        for attempt in range(settings.spotify_max_retries + 1):
+            async with self._semaphore:
+                wait = self._resume_at - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+
+                try:
+                    result = await loop.run_in_executor(_executor, partial(method, *args, **kwargs))
+                except SpotifyException as e:
+                    retryable = e.http_status == 429 or e.http_status >= 500
+                    if not retryable or attempt == settings.spotify_max_retries:
+                        raise
+                    self._throttle(_retry_after(e))
+                    continue
+
+                self._backoff = max(settings.spotify_backoff_base, self._backoff / 2)
+                return result
+
+    def _throttle(self, retry_after: float | None):
+        """Push back the shared resume time after a rate-limit or server error."""
+        if retry_after is not None:
+            delay = retry_after
+        else:
+            delay = self._backoff * random.uniform(1.0, 1.5)
+            self._backoff = min(settings.spotify_backoff_max, self._backoff * 2)
+        self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+    async def fetch_pages(self, method, total: int, *args, limit: int = 50, start: int = 0, **kwargs):
+        """Yield (offset, page) for every page up to `total`, in completion order."""
+        tasks = [
+            asyncio.ensure_future(self._fetch_page(method, offset, *args, limit=limit, **kwargs))
+            for offset in range(start, total, limit)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _fetch_page(self, method, offset: int, *args, limit: int, **kwargs):
+        page = await self.call(method, *args, offset=offset, limit=limit, **kwargs)
+        return offset, page
@@ -0,0 +1,144 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from .clap import clap_model_key
+from .config import settings
+
+
+def normalize_query(text: str) -> str:
+    """Canonical form of a query so trivially different spellings share an entry."""
+    return " ".join(text.casefold().split())
+
+
+class TextEmbeddingCache:
+    """Bounded LRU cache of CLAP text embeddings with an optional SQLite tier.
+
+    Entries are keyed on the model identity (audio encoder, checkpoint,
+    backend) plus the normalized query text, so switching models never
+    serves stale vectors. The disk tier keeps the `disk_max_size` most
+    recently used entries.
+    """
+
+    def __init__(self, model_key: str, max_size: int = 1024, path: Path | None = None,
+                 disk_max_size: int = 100_000):
+        self.model_key = model_key
+        self.max_size = max_size
+        self.disk_max_size = disk_max_size
+        self._entries: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = None
+        self._disk_size = 0
+        if path is not None:
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS text_embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, used_at REAL NOT NULL DEFAULT 0)"
+            )
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(text_embeddings)")}
+            if "used_at" not in columns:
+                # Tables from before the cap: existing rows count as least recently used
+                self._db.execute("ALTER TABLE text_embeddings ADD COLUMN used_at REAL NOT NULL DEFAULT 0")
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS ix_text_embeddings_used_at ON text_embeddings (used_at)"
+            )
+            self._disk_size = self._db.execute("SELECT COUNT(*) FROM text_embeddings").fetchone()[0]
+            self._trim()
+            self._db.commit()
+
+    def _key(self, text: str) -> str:
+        return f"{self.model_key}\x00{normalize_query(text)}"
+
+    def get(self, text: str) -> np.ndarray | None:
+        """Look up a query, promoting disk entries into memory."""
+        key = self._key(text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT vector FROM text_embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._insert(key, vector)
+                    self._db.execute(
+                        "UPDATE text_embeddings SET used_at = ? WHERE key = ?", (time.time(), key)
+                    )
+                    self._db.commit()
+                    self.disk_hits += 1
+                    return vector
+
+            self.misses += 1
+            return None
+
+    def put(self, text: str, vector) -> None:
+        """Store a query embedding in memory and, if enabled, on disk."""
+        key = self._key(text)
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._insert(key, vector)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO text_embeddings (key, vector, used_at) VALUES (?, ?, ?)",
+                    (key, vector.tobytes(), time.time())
+                )
+                # Only misses are put, so this is nearly always a new row
+                self._disk_size += 1
+                self._trim()
+                self._db.commit()
+
+    def _trim(self):
+        """Past the disk cap, drop the least recently used rows down to 90% of it.
+
+        Trimming below the cap means the sort runs once per many puts, not on each.
+        """
+        if self._disk_size <= self.disk_max_size:
+            return
+        keep = int(self.disk_max_size * 0.9)
+        self._db.execute(
+            "DELETE FROM text_embeddings WHERE key IN ("
+            "SELECT key FROM text_embeddings ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+            (keep,),
+        )
+        self._disk_size = self._db.execute("SELECT COUNT(*) FROM text_embeddings").fetchone()[0]
+
+    def _insert(self, key: str, vector: np.ndarray):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "disk_size": self._disk_size,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Shared cache for /api/search; non-eager backends get their own entries
+text_cache = TextEmbeddingCache(
+    model_key=clap_model_key() if settings.inference_backend == "eager"
+    else f"{clap_model_key()}+{settings.inference_backend}",
+    max_size=settings.text_cache_size,
+    path=settings.data_dir / "text_cache.db" if settings.text_cache_persist else None,
+    disk_max_size=settings.text_cache_disk_size,
+)
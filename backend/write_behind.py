@@ -0,0 +1,204 @@
+import asyncio
+import time
+
+from . import jobs
+from .config import settings
+from .database import get_session, run_db
+from .db import collection
+from .index import get_index
+from .metrics import Collected, stage_seconds
+
+
+class WriteBehind:
+    """Buffers pipeline status transitions and vectors and writes them in batches.
+
+    Download and embed record outcomes here instead of committing each one.
+    A flush happens once `max_items` writes are waiting or `max_delay`
+    seconds after the first one, and writes everything in one SQLite
+    transaction plus one Chroma upsert. Writes within a flush keep their
+    meaning: the latest status per song wins, retries/failures are applied
+    after plain status changes, and new jobs are queued last, so they see
+    the statuses written with them.
+
+    Buffered jobs stay leased, so if the process dies before a flush they
+    are simply claimed again. A flush that fails puts its writes back in
+    the buffer and is retried with backoff; flush() and drain() also
+    raise, so a runner waiting on them stops with the error instead of
+    finishing with writes unsaved. All methods except flush() are called from the event
+    loop.
+    """
+
+    def __init__(self, max_items: int, max_delay: float):
+        self.max_items = max(1, max_items)
+        self.max_delay = max_delay
+        self.flushes = 0
+        self.written = 0
+        self.flush_seconds = 0.0
+        self.failures = 0
+        self._lock = asyncio.Lock()
+        self._timer: asyncio.TimerHandle | None = None
+        self._retry_delay: float | None = None  # set while flushes are failing
+        self._reset()
+
+    def _reset(self):
+        self._statuses: dict[tuple[str, str], tuple[str, str | None]] = {}
+        self._completed: list[int] = []
+        self._failed: list[tuple[str, dict, str | None]] = []
+        self._vectors: dict[str, tuple[list[float], dict]] = {}
+        self._enqueued: list[tuple[str, str, asyncio.Future]] = []
+
+    def __len__(self) -> int:
+        return (
+            len(self._statuses) + len(self._completed) + len(self._failed)
+            + len(self._vectors) + len(self._enqueued)
+        )
+
+    def set_status(self, kind: str, spotify_id: str, status: str, file_path: str | None = None):
+        """Buffer a song status change for the job kind's status column."""
+        self._statuses[(kind, spotify_id)] = (status, file_path)
+        self._schedule()
+
+    def complete(self, job_id: int):
+        self._completed.append(job_id)
+        self._schedule()
+
+    def fail(self, kind: str, job: dict, error: str | None = None):
+        """Buffer a failed attempt; see jobs.fail for retry handling."""
+        self._failed.append((kind, job, error))
+        self._schedule()
+
+    def store(self, song: dict, vector: list[float], metadata: dict):
+        """Buffer an embedding: upserted to Chroma and the index, then the song is stored and its job done."""
+        self._vectors[song["spotify_id"]] = (vector, metadata)
+        self._statuses[("embed", song["spotify_id"])] = ("stored", None)
+        self._completed.append(song["job_id"])
+        self._schedule()
+
+    def enqueue(self, kind: str, spotify_id: str) -> asyncio.Future:
+        """Buffer queuing a job for a song; the future resolves once the job is written."""
+        future = asyncio.get_running_loop().create_future()
+        self._enqueued.append((kind, spotify_id, future))
+        self._schedule()
+        return future
+
+    def _schedule(self):
+        if len(self) >= self.max_items and self._retry_delay is None:
+            asyncio.create_task(self._flush_in_background())
+        elif self._timer is None:
+            delay = self._retry_delay or self.max_delay
+            self._timer = asyncio.get_running_loop().call_later(
+                delay, lambda: asyncio.create_task(self._flush_in_background())
+            )
+
+    async def _flush_in_background(self):
+        try:
+            await self.flush()
+        except Exception:
+            # Already logged, and the writes are back in the buffer
+            pass
+
+    async def flush(self):
+        """Write everything buffered now; flushes run one at a time, in order.
+
+        Raises if the write fails, after putting the batch back in the buffer.
+        """
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not len(self):
+                return
+
+            batch = (self._statuses, self._completed, self._failed, self._vectors, self._enqueued)
+            count = len(self)
+            self._reset()
+
+            started = time.perf_counter()
+            try:
+                await run_db(_write, *batch)
+            except Exception as e:
+                self.failures += 1
+                self._retry_delay = min(30.0, 2 * (self._retry_delay or self.max_delay))
+                print(f"Write-behind flush of {count} writes failed, retrying in {self._retry_delay:.1f}s: {e}")
+                self._restore(*batch)
+                self._schedule()
+                raise
+
+            elapsed = time.perf_counter() - started
+            self.flushes += 1
+            self.written += count
+            self.flush_seconds += elapsed
+            self._retry_delay = None
+            stage_seconds.observe(elapsed, "write_flush")
+            for _, _, future in batch[4]:
+                if not future.done():
+                    future.set_result(None)
+
+    async def drain(self, attempts: int = 5):
+        """flush(), retrying a failed write with backoff before raising.
+
+        For runners about to finish or sleep, which must not leave writes behind.
+        """
+        for attempt in range(attempts):
+            try:
+                return await self.flush()
+            except Exception:
+                if attempt == attempts - 1:
+                    raise
+                await asyncio.sleep(self._retry_delay or self.max_delay)
+
+    def _restore(self, statuses, completed, failed, vectors, enqueued):
+        """Put a failed flush's writes back, ahead of anything buffered since (newer statuses win)."""
+        self._statuses = {**statuses, **self._statuses}
+        self._completed = completed + self._completed
+        self._failed = failed + self._failed
+        self._vectors = {**vectors, **self._vectors}
+        self._enqueued = enqueued + self._enqueued
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self),
+            "flushes": self.flushes,
+            "failures": self.failures,
+            "written": self.written,
+            "mean_flush_ms": round(1000 * self.flush_seconds / self.flushes, 2) if self.flushes else 0.0,
+        }
+
+
+def _write(
+    statuses: dict[tuple[str, str], tuple[str, str | None]],
+    completed: list[int],
+    failed: list[tuple[str, dict, str | None]],
+    vectors: dict[str, tuple[list[float], dict]],
+    enqueued: list[tuple[str, str, asyncio.Future]],
+):
+    """Apply one flush: vectors first, then every SQLite change in a single transaction."""
+    if vectors:
+        ids = list(vectors)
+        embeddings = [vectors[i][0] for i in ids]
+        metadatas = [vectors[i][1] for i in ids]
+        collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas)
+        get_index().add(ids, embeddings, metadatas)
+
+    by_kind: dict[str, list[tuple[str, str, str | None]]] = {}
+    for (kind, spotify_id), (status, file_path) in statuses.items():
+        by_kind.setdefault(kind, []).append((spotify_id, status, file_path))
+    to_enqueue: dict[str, list[str]] = {}
+    for kind, spotify_id, _ in enqueued:
+        to_enqueue.setdefault(kind, []).append(spotify_id)
+
+    with get_session() as session:
+        for kind, updates in by_kind.items():
+            jobs.set_status(kind, updates, session=session)
+        for kind, job, error in failed:
+            jobs.fail(kind, [job], error, session=session)
+        jobs.complete(completed, session=session)
+        for kind, spotify_ids in to_enqueue.items():
+            jobs.enqueue(kind, spotify_ids, session=session)
+
+
+# Shared buffer for the download and embed runners
+writes = WriteBehind(max_items=settings.write_batch_size, max_delay=settings.write_flush_seconds)
+
+Collected("vibe_write_behind_pending", "Status and vector writes waiting for the next flush.",
+          lambda: len(writes))
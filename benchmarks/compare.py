@@ -0,0 +1,64 @@
+"""Compare two benchmark result files metric by metric.
+
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+
+Prints every numeric result present in both runs with its relative change.
+Timings (keys ending in _ms or seconds) are better when lower, rates
+(per_second) when higher; changes beyond --threshold in the wrong
+direction are flagged.
+"""
+import argparse
+import json
+
+
+def _flatten(tree: dict, prefix: str = "") -> dict[str, float]:
+    flat = {}
+    for key, value in tree.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def _direction(path: str) -> int:
+    """+1 if higher is better, -1 if lower is better, 0 if neither."""
+    if ".setup." in path:
+        return 0  # fixture build time, not the code under test
+    leaf = path.rsplit(".", 1)[-1]
+    if "per_second" in leaf:
+        return 1
+    if leaf.endswith("_ms") or leaf.endswith("seconds"):
+        return -1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change worth flagging")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = _flatten(json.load(f)["scales"])
+    with open(args.after) as f:
+        after = _flatten(json.load(f)["scales"])
+
+    regressions = 0
+    for path in sorted(before.keys() & after.keys()):
+        old, new = before[path], after[path]
+        if old == 0:
+            continue
+        change = (new - old) / abs(old)
+        worse = _direction(path) * change < -args.threshold
+        regressions += worse
+        flag = "  REGRESSION" if worse else ""
+        print(f"{path:70} {old:>12g} → {new:<12g} {change:+7.1%}{flag}")
+
+    print(f"{regressions} regression(s) beyond {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
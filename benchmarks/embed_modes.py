@@ -0,0 +1,134 @@
+"""Whole-track vs sampled-window embedding on the same library.
+
+Embeds up to --songs files from audio_dir both ways with the configured CLAP
+model and reports throughput (decode and inference separately) plus how well
+the windowed vectors agree with whole-track ones: per-track cosine and the
+top-k overlap of a fixed set of searches.
+
+    python -m benchmarks.embed_modes --songs 100 --windows 3 --seconds 10
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from backend.audio import AUDIO_EXTENSIONS, load_crop, load_windows
+from backend.clap import embed_clips, load_clap
+from backend.config import settings
+from backend.inference import configure_threads
+
+PROMPTS = [
+    "upbeat summer pop with bright synths",
+    "melancholic piano ballad",
+    "aggressive heavy metal with double bass drums",
+    "lo-fi hip hop beats to study to",
+    "acoustic folk with fingerpicked guitar",
+    "dark ambient drone",
+    "eighties synthwave with gated reverb drums",
+    "jazz trio with upright bass and brushes",
+    "euphoric festival house drop",
+    "slow sad country song with pedal steel",
+]
+
+
+def _library(limit: int) -> list[str]:
+    extensions = set(AUDIO_EXTENSIONS.values())
+    files = sorted(p for p in settings.audio_dir.iterdir() if p.suffix in extensions)
+    return [str(p) for p in files[:limit]]
+
+
+def _whole(path: str) -> list | None:
+    # What CLAP keeps of a whole track, decoded the way full mode does it
+    waveform = load_crop(path)
+    return None if waveform is None else [waveform]
+
+
+def _run(model, files: list[str], decode) -> dict:
+    """Decode and embed every file with `decode`, timing both stages."""
+    started = time.perf_counter()
+    clips = [decode(path) for path in files]
+    decoded = time.perf_counter()
+
+    vectors = []
+    for start in range(0, len(clips), settings.embed_batch_size):
+        vectors += embed_clips(model, clips[start:start + settings.embed_batch_size])
+    finished = time.perf_counter()
+
+    return {
+        "vectors": vectors,
+        "decode_seconds": decoded - started,
+        "embed_seconds": finished - decoded,
+    }
+
+
+def _top_k(queries: np.ndarray, vectors: np.ndarray, k: int) -> np.ndarray:
+    return np.argsort(-(queries @ vectors.T), axis=1)[:, :k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--songs", type=int, default=100)
+    parser.add_argument("--windows", type=int, default=settings.embed_window_count)
+    parser.add_argument("--seconds", type=float, default=settings.embed_window_seconds)
+    parser.add_argument("--k", type=int, default=10, help="search depth for top-k agreement")
+    parser.add_argument("--out", help="also write the report to this JSON file")
+    args = parser.parse_args()
+
+    files = _library(args.songs)
+    if not files:
+        raise SystemExit(f"No audio in {settings.audio_dir}")
+
+    configure_threads()
+    model = load_clap(settings.clap_amodel, settings.clap_checkpoint, settings.inference_backend)
+
+    full = _run(model, files, _whole)
+    windows = _run(model, files, lambda path: load_windows(path, args.windows, args.seconds))
+
+    # Compare only tracks both modes could embed
+    both = [i for i, (a, b) in enumerate(zip(full["vectors"], windows["vectors"])) if a is not None and b is not None]
+    if not both:
+        raise SystemExit("No track could be embedded in both modes")
+    a = np.asarray([full["vectors"][i] for i in both], dtype=np.float32)
+    b = np.asarray([windows["vectors"][i] for i in both], dtype=np.float32)
+    cosine = np.sum(a * b, axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+
+    queries = np.asarray(model.get_text_embedding(PROMPTS, use_tensor=False), dtype=np.float32)
+    k = min(args.k, len(both))
+    top_full, top_windows = _top_k(queries, a, k), _top_k(queries, b, k)
+    overlap = [len(set(x) & set(y)) / k for x, y in zip(top_full, top_windows)]
+
+    def stage(run: dict) -> dict:
+        total = run["decode_seconds"] + run["embed_seconds"]
+        return {
+            "tracks_per_second": round(len(files) / total, 3),
+            "decode_seconds": round(run["decode_seconds"], 2),
+            "embed_seconds": round(run["embed_seconds"], 2),
+        }
+
+    report = {
+        "songs": len(files),
+        "compared": len(both),
+        "windows": {"count": args.windows, "seconds": args.seconds},
+        "full": stage(full),
+        "sampled": stage(windows),
+        "speedup": round(
+            (full["decode_seconds"] + full["embed_seconds"])
+            / (windows["decode_seconds"] + windows["embed_seconds"]), 2
+        ),
+        "agreement": {
+            "cosine_mean": round(float(cosine.mean()), 4),
+            "cosine_min": round(float(cosine.min()), 4),
+            f"top{k}_overlap": round(float(np.mean(overlap)), 4),
+            "top1_match": round(float(np.mean(top_full[:, 0] == top_windows[:, 0])), 4),
+        },
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
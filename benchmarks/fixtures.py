@@ -0,0 +1,167 @@
+"""Offline stand-ins for the benchmark suite: stub CLAP, fake yt-dlp, synthetic library.
+
+Nothing here touches the network or needs a GPU, and everything is seeded,
+so two runs on the same machine do the same work.
+
+Imports from backend happen inside functions: settings are read once at
+import time, so the runner has to point DATA_DIR & co. at a scratch
+directory before anything from backend is loaded.
+"""
+import hashlib
+import time
+
+import numpy as np
+
+
+def _seed(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def _unit(rng: np.random.Generator, dim: int) -> np.ndarray:
+    vector = rng.standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class StubCLAP:
+    """Deterministic CLAP_Module stand-in: vectors derived from a hash of the input.
+
+    `text_ms` / `audio_ms` add a fixed cost per input, to model inference
+    time without loading weights.
+    """
+
+    def __init__(self, dim: int = 512, text_ms: float = 0.0, audio_ms: float = 0.0):
+        self.dim = dim
+        self.text_ms = text_ms
+        self.audio_ms = audio_ms
+        self.text_calls = 0
+        self.audio_calls = 0
+
+    def get_text_embedding(self, x, use_tensor=False):
+        self.text_calls += 1
+        if self.text_ms:
+            time.sleep(self.text_ms * len(x) / 1000)
+        return np.stack([_unit(np.random.default_rng(_seed(text.encode())), self.dim) for text in x])
+
+    def get_audio_embedding_from_data(self, x, use_tensor=False):
+        self.audio_calls += 1
+        if self.audio_ms:
+            time.sleep(self.audio_ms * len(x) / 1000)
+        return np.stack([
+            _unit(np.random.default_rng(_seed(np.asarray(waveform[:4096]).tobytes())), self.dim)
+            for waveform in x
+        ])
+
+
+def stub_clips(file_path: str) -> list[np.ndarray] | None:
+    """Stand-in for audio.load_clips: one short waveform derived from the file's bytes."""
+    try:
+        with open(file_path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    rng = np.random.default_rng(_seed(data))
+    return [rng.standard_normal(4800).astype(np.float32)]
+
+
+def fake_ytdlp_worker(conn, params: dict):
+    """DownloadPool target speaking the yt-dlp worker protocol without yt-dlp.
+
+    Each job sleeps `bench_download_ms`, then writes a small file with the
+    extension the configured postprocessor would produce. Queries whose
+    hash falls under `bench_fail_rate` fail, the same ones every run.
+    """
+    delay = params.get("bench_download_ms", 0) / 1000
+    fail_rate = params.get("bench_fail_rate", 0.0)
+    codec = params["postprocessors"][0]["preferredcodec"]
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+
+        query, outtmpl = job
+        seed = _seed(query.encode())
+        time.sleep(delay)
+        if (seed % 10000) / 10000 < fail_rate:
+            conn.send((False, "ERROR: [youtube] video unavailable"))
+            continue
+
+        content = np.random.default_rng(seed).bytes(4096)
+        with open(outtmpl.replace("%(ext)s", codec), "wb") as f:
+            f.write(content)
+        conn.send((True, None))
+
+
+def make_library(count: int, dim: int = 512, seed: int = 0, page: int = 5000) -> dict:
+    """Insert `count` downloaded-and-embedded songs with random vectors.
+
+    Rows go into SQLite, an empty file per song into audio_dir (so
+    reconciliation finds them) and the vectors into ChromaDB. Returns
+    setup timings.
+    """
+    from datetime import datetime, timedelta
+
+    from sqlmodel import insert
+
+    from backend.audio import audio_path
+    from backend.clap import clap_model_key
+    from backend.database import get_session
+    from backend.db import collection
+    from backend.models import Song
+
+    rng = np.random.default_rng(seed)
+    now = datetime.utcnow()
+    timings = {}
+
+    started = time.perf_counter()
+    rows = []
+    for i in range(count):
+        spotify_id = f"lib{i:07d}"
+        rows.append({
+            "spotify_id": spotify_id,
+            "title": f"Library Song {i}",
+            "artist": f"Artist {i % 997}",
+            "album": f"Album {i % 4999}",
+            "uri": f"spotify:track:{spotify_id}",
+            "added_at": now - timedelta(minutes=i),
+            "album_art_url": "https://i.example/a.jpg",
+            "spotify_link": f"https://open.spotify.com/track/{spotify_id}",
+            "download_status": "done",
+            "embed_status": "stored",
+            "file_path": str(audio_path(spotify_id)),
+            "created_at": now,
+            "updated_at": now,
+        })
+    with get_session() as session:
+        for start in range(0, count, page):
+            session.execute(insert(Song), rows[start:start + page])
+    for row in rows:
+        open(row["file_path"], "wb").close()
+    timings["sqlite_and_files_seconds"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for start in range(0, count, page):
+        chunk = rows[start:start + page]
+        vectors = rng.standard_normal((len(chunk), dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        collection.add(
+            ids=[row["spotify_id"] for row in chunk],
+            embeddings=vectors.tolist(),
+            metadatas=[
+                {
+                    "title": row["title"],
+                    "artist": row["artist"],
+                    "album": row["album"],
+                    "album_art_url": row["album_art_url"],
+                    "spotify_link": row["spotify_link"],
+                    "clap_model": clap_model_key(),
+                    "embed_mode": "full",
+                }
+                for row in chunk
+            ],
+        )
+    timings["chroma_seconds"] = time.perf_counter() - started
+    return timings
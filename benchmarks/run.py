@@ -0,0 +1,411 @@
+"""Benchmark suite: search, library, sync ingest, reconciliation and the pipelines.
+
+Each scale runs in a fresh process against a scratch data directory holding
+a synthetic library (random 512-dim vectors in a temporary Chroma
+collection), with a stub CLAP model, fake yt-dlp workers and a fake
+Spotify API. Everything is offline, CPU-only and seeded. Results go to
+benchmarks/results/ as JSON; compare two runs with benchmarks.compare.
+
+    python -m benchmarks.run --scales 1k 10k 100k
+    python -m benchmarks.run --scales 10k --only search library
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from .fixtures import StubCLAP, fake_ytdlp_worker, make_library, stub_clips
+
+SCALES = {"1k": 1_000, "10k": 10_000, "100k": 100_000}
+BENCHMARKS = ("search", "library", "sync", "reconcile", "pipeline")
+RESULTS_DIR = Path(__file__).parent / "results"
+
+_MOODS = ["upbeat", "melancholic", "dreamy", "aggressive", "chill", "euphoric", "dark", "warm"]
+_STYLES = ["synthwave", "piano ballad", "lo-fi hip hop", "folk", "techno", "jazz trio", "metal", "soul"]
+_DETAILS = ["for a rainy night", "with big drums", "at sunrise", "with female vocals", "instrumental"]
+
+
+def _queries(count: int) -> list[str]:
+    combos = [f"{m} {s} {d}" for d in _DETAILS for s in _STYLES for m in _MOODS]
+    return [combos[i % len(combos)] + ("" if i < len(combos) else f" #{i}") for i in range(count)]
+
+
+def _latency(seconds: list[float]) -> dict:
+    ms = np.asarray(seconds) * 1000
+    return {
+        "n": len(ms),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+async def _timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = await fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def _counters() -> dict:
+    """SQLite sessions and write-behind flushes so far, for per-stage deltas."""
+    from backend.metrics import sqlite_session_seconds
+    from backend.write_behind import writes
+    sessions = sum(count for count, _ in sqlite_session_seconds.totals().values())
+    return {"sqlite_sessions": sessions, "write_flushes": writes.flushes}
+
+
+def _delta(before: dict) -> dict:
+    after = _counters()
+    return {key: after[key] - before[key] for key in before}
+
+
+# ---- benchmarks ----
+
+async def bench_search(client, args) -> dict:
+    """Cold (text encode) and warm (cached) single searches, batches and concurrent load."""
+    from backend.metrics import search_seconds
+
+    queries = _queries(args.queries)
+    result = {}
+
+    for phase in ("cold", "warm"):
+        latencies = []
+        for query in queries:
+            response, seconds = await _timed(client.post, "/api/search", json={"query": query, "n_results": 20})
+            response.raise_for_status()
+            latencies.append(seconds)
+        result[phase] = _latency(latencies)
+
+    latencies = []
+    for start in range(0, len(queries), 32):
+        batch = [{"query": q, "n_results": 20} for q in queries[start:start + 32]]
+        response, seconds = await _timed(client.post, "/api/search/batch", json=batch)
+        response.raise_for_status()
+        latencies.append(seconds)
+    result["batch_of_32"] = _latency(latencies)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(query):
+        async with semaphore:
+            (await client.post("/api/search", json={"query": query, "n_results": 20})).raise_for_status()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(q) for q in queries))
+    result["concurrent"] = {
+        "concurrency": args.concurrency,
+        "queries_per_second": round(len(queries) / (time.perf_counter() - started), 1),
+    }
+
+    # Where the time went, from the /metrics histograms (all phases above)
+    result["phases_mean_ms"] = {
+        phase: round(1000 * total / count, 3)
+        for (phase,), (count, total) in sorted(search_seconds.totals().items())
+        if count
+    }
+    return result
+
+
+async def bench_library(client, count: int, repeat: int = 50) -> dict:
+    """First page, a cursor walk, a filtered page and ETag revalidation."""
+    result = {}
+
+    latencies = []
+    for _ in range(repeat):
+        response, seconds = await _timed(client.get, "/api/library", params={"limit": 100})
+        response.raise_for_status()
+        latencies.append(seconds)
+    result["first_page"] = _latency(latencies)
+    etag = response.headers["etag"]
+
+    latencies, cursor = [], None
+    for _ in range(min(50, max(1, count // 100))):
+        params = {"limit": 100, **({"cursor": cursor} if cursor else {})}
+        response, seconds = await _timed(client.get, "/api/library", params=params)
+        latencies.append(seconds)
+        cursor = response.json()["next_cursor"]
+        if cursor is None:
+            break
+    result["cursor_walk"] = _latency(latencies)
+
+    latencies = []
+    for i in range(repeat):
+        params = {"limit": 100, "embed_status": "stored", "artist": f"Artist {i % 997}"}
+        response, seconds = await _timed(client.get, "/api/library", params=params)
+        response.raise_for_status()
+        latencies.append(seconds)
+    result["filtered"] = _latency(latencies)
+
+    latencies = []
+    for _ in range(repeat):
+        response, seconds = await _timed(
+            client.get, "/api/library", params={"limit": 100}, headers={"If-None-Match": etag}
+        )
+        assert response.status_code == 304, response.status_code
+        latencies.append(seconds)
+    result["revalidate_304"] = _latency(latencies)
+    return result
+
+
+async def bench_sync(count: int) -> dict:
+    """Playlist sync against the fake Spotify API: first import, full resync, unchanged snapshot."""
+    from backend import spotify
+    from backend.fake_spotify import FakeSpotify
+    from backend.routers import sync
+
+    fake = FakeSpotify()
+    fake.add_playlist("bench", fake.make_tracks(count))
+    spotify._http.mount("https://api.spotify.com/", fake)
+    sync._state["access_token"] = "bench"
+
+    result = {}
+    for name, full in (("import", True), ("resync", True), ("unchanged", False)):
+        before = sum(fake.calls.values())
+        counters = _counters()
+        _, seconds = await _timed(sync._sync_playlist, "bench", full=full)
+        status = sync._state["progress"]["status"]
+        if status != "complete":
+            raise RuntimeError(f"sync {name} ended with {status}")
+        result[name] = {
+            "seconds": round(seconds, 3),
+            "tracks_per_second": round(count / seconds, 1),
+            "api_requests": sum(fake.calls.values()) - before,
+            **_delta(counters),
+        }
+    return result
+
+
+async def bench_reconcile() -> dict:
+    """Forced scans of audio_dir and Chroma ids, then the unchanged fast path."""
+    from backend.database import run_db
+    from backend.reconcile import reconcile_downloads, reconcile_embeddings
+
+    result = {}
+    for name, fn in (("downloads", reconcile_downloads), ("embeddings", reconcile_embeddings)):
+        fixed, seconds = await _timed(run_db, fn, True)
+        _, unchanged = await _timed(run_db, fn)
+        result[name] = {
+            "scan_seconds": round(seconds, 4),
+            "unchanged_seconds": round(unchanged, 4),
+            "fixed": {key: value for key, value in fixed.items() if key != "skipped"},
+        }
+    return result
+
+
+async def bench_pipeline(args) -> dict:
+    """Download, then embed, then both at once as a pipeline, over the same new songs."""
+    from sqlalchemy import text
+    from sqlmodel import update
+
+    from backend.audio import find_audio
+    from backend.database import get_session, run_db
+    from backend.db import collection
+    from backend.downloader import DownloadPool
+    from backend.fake_spotify import FakeSpotify
+    from backend.index import get_index
+    from backend.models import Song
+    from backend.routers import download, embed, pipeline, sync
+
+    # Only the benchmark's songs should be pending
+    with get_session() as session:
+        session.execute(text("UPDATE song SET download_status = 'failed' WHERE download_status = 'pending'"))
+    items = FakeSpotify.make_tracks(args.pipeline_songs, start=900_000)
+    await run_db(sync._ingest_tracks, items)
+    ids = [item["track"]["id"] for item in items]
+
+    download._pool.close()
+    download._pool = DownloadPool(
+        size=download._limiter.maximum,
+        params={
+            **download._ydl_params,
+            "bench_download_ms": args.download_ms,
+            "bench_fail_rate": args.fail_rate,
+        },
+        target=fake_ytdlp_worker,
+    )
+    embed.load_clips = stub_clips
+
+    def stage_result(seconds: float, counters: dict) -> dict:
+        return {
+            "seconds": round(seconds, 3),
+            "songs_per_second": round(len(ids) / seconds, 1),
+            "downloaded": download._state["progress"]["success"],
+            "download_failed": download._state["progress"]["failed"],
+            "embedded": embed._state["progress"]["current"],
+            **_delta(counters),
+        }
+
+    result = {"songs": len(ids), "download_ms": args.download_ms, "embed_ms": args.embed_ms}
+
+    counters, started = _counters(), time.perf_counter()
+    await download.start_download()
+    await download._state["runner"]
+    result["download"] = stage_result(time.perf_counter() - started, counters)
+    result["download"]["final_limit"] = download._limiter.limit
+
+    counters, started = _counters(), time.perf_counter()
+    await embed.start_embed()
+    await embed._state["runner"]
+    result["embed"] = stage_result(time.perf_counter() - started, counters)
+
+    # Reset the same songs and run both stages overlapped
+    collection.delete(ids=ids)
+    get_index().remove(ids)
+    for spotify_id in ids:
+        if (path := find_audio(spotify_id)) is not None:
+            path.unlink()
+    with get_session() as session:
+        for start in range(0, len(ids), 500):
+            session.execute(
+                update(Song)
+                .where(Song.spotify_id.in_(ids[start:start + 500]))
+                .values(download_status="pending", embed_status="pending", file_path=None)
+            )
+
+    counters, started = _counters(), time.perf_counter()
+    await pipeline.start_pipeline()
+    await pipeline._state["runner"]
+    result["pipeline"] = stage_result(time.perf_counter() - started, counters)
+    return result
+
+
+# ---- runner ----
+
+async def run_scale(count: int, args) -> dict:
+    """Build a library of `count` songs in this process's scratch dir and run the benchmarks."""
+    import httpx
+
+    from backend import main
+    from backend.clap import model_manager
+    from backend.database import init_db
+    from backend.index import get_index
+    from backend.routers import download, embed
+
+    init_db()
+    result = {"songs": count, "setup": make_library(count, seed=args.seed)}
+    started = time.perf_counter()
+    get_index()
+    result["setup"]["index_load_seconds"] = time.perf_counter() - started
+    result["setup"] = {key: round(value, 3) for key, value in result["setup"].items()}
+
+    model_manager.set(StubCLAP(text_ms=args.text_ms, audio_ms=args.embed_ms))
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        if "search" in args.only:
+            result["search"] = await bench_search(client, args)
+        if "library" in args.only:
+            result["library"] = await bench_library(client, count)
+
+    try:
+        if "sync" in args.only:
+            result["sync"] = await bench_sync(count)
+        if "reconcile" in args.only:
+            result["reconcile"] = await bench_reconcile()
+        if "pipeline" in args.only:
+            result["pipeline"] = await bench_pipeline(args)
+    finally:
+        download.shutdown()
+        embed.shutdown()
+    return result
+
+
+def _scratch_env(scratch: str, args) -> dict:
+    """Settings for a child run: everything under `scratch`, nothing loaded or cached across runs."""
+    return {
+        "DATA_DIR": scratch,
+        "AUDIO_DIR": os.path.join(scratch, "audio"),
+        "CHROMA_DIR": os.path.join(scratch, "chroma"),
+        "LIBRARY_PATH": os.path.join(scratch, "library.json"),
+        "CLAP_LOAD_ON_STARTUP": "false",
+        "CLAP_WARMUP": "false",
+        "SEARCH_BACKEND": args.search_backend,
+        "EMBED_MODE": "full",
+        "EMBED_WORKERS": "1",
+        "EMBEDDING_CACHE": "false",
+        "TEXT_CACHE_PERSIST": "false",
+        "DOWNLOAD_MODE": "full",
+        "JOB_RETRY_BASE_SECONDS": "0.05",
+        "PROFILING_ENABLED": "false",
+        "PROFILE_SLOW_REQUESTS": "0",
+    }
+
+
+def _meta(args) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "args": {key: value for key, value in vars(args).items() if not key.startswith("child")},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite")
+    parser.add_argument("--scales", nargs="+", choices=SCALES, default=["1k", "10k"])
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument("--queries", type=int, default=200, help="distinct search queries")
+    parser.add_argument("--concurrency", type=int, default=8, help="in-flight searches for the load test")
+    parser.add_argument("--pipeline-songs", type=int, default=200)
+    parser.add_argument("--download-ms", type=float, default=20, help="fake yt-dlp time per song")
+    parser.add_argument("--fail-rate", type=float, default=0.02, help="share of fake downloads that fail")
+    parser.add_argument("--text-ms", type=float, default=0, help="stub CLAP time per text query")
+    parser.add_argument("--embed-ms", type=float, default=2, help="stub CLAP time per audio clip")
+    parser.add_argument("--search-backend", choices=("numpy", "chroma"), default="numpy")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="results file (default benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--child-scale", help=argparse.SUPPRESS)
+    parser.add_argument("--child-out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child_scale:
+        result = asyncio.run(run_scale(SCALES[args.child_scale], args))
+        with open(args.child_out, "w") as f:
+            json.dump(result, f)
+        return
+
+    report = {"meta": _meta(args), "scales": {}}
+    for scale in args.scales:
+        print(f"Running {scale}...", flush=True)
+        with tempfile.TemporaryDirectory(prefix=f"vibe-bench-{scale}-") as scratch:
+            child_out = os.path.join(scratch, "result.json")
+            subprocess.run(
+                [sys.executable, "-m", "benchmarks.run", *sys.argv[1:],
+                 "--child-scale", scale, "--child-out", child_out],
+                env={**os.environ, **_scratch_env(scratch, args)},
+                cwd=Path(__file__).parent.parent,
+                check=True,
+            )
+            with open(child_out) as f:
+                report["scales"][scale] = json.load(f)
+
+    out = Path(args.out) if args.out else RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print(json.dumps(report["scales"], indent=2))
+    print(f"Results written to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""Shared fixtures. Settings are read when backend is first imported, so the
+scratch data directory has to be in the environment before that."""
+import os
+import tempfile
+
+import pytest
+
+_scratch = tempfile.mkdtemp(prefix="vibe-tests-")
+os.environ.update(
+    DATA_DIR=_scratch,
+    AUDIO_DIR=os.path.join(_scratch, "audio"),
+    CHROMA_DIR=os.path.join(_scratch, "chroma"),
+    CLAP_LOAD_ON_STARTUP="false",
+)
+
+from backend import spotify  # noqa: E402
+from backend.database import init_db  # noqa: E402
+from backend.fake_spotify import FakeSpotify  # noqa: E402
+from backend.routers import sync  # noqa: E402
+
+init_db()
+
+
+@pytest.fixture
+def fake_spotify():
+    """A FakeSpotify mounted on the shared Spotify session, with a token set."""
+    fake = FakeSpotify()
+    original = spotify._http.get_adapter("https://api.spotify.com/")
+    spotify._http.mount("https://api.spotify.com/", fake)
+    sync._state["access_token"] = "test"
+    yield fake
+    spotify._http.mount("https://api.spotify.com/", original)
+    sync._state["access_token"] = None
@@ -0,0 +1,54 @@
+"""Pipeline runs with fake yt-dlp workers and a stub CLAP model."""
+import asyncio
+
+from sqlalchemy import text
+
+from backend import jobs
+from backend.clap import model_manager
+from backend.config import settings
+from backend.database import get_session
+from backend.downloader import DownloadPool
+from backend.events import bus
+from backend.fake_spotify import FakeSpotify
+from backend.routers import download, embed, pipeline, sync
+from benchmarks.fixtures import StubCLAP, fake_ytdlp_worker
+
+
+def test_embed_failure_stops_the_pipeline(monkeypatch):
+    # Only this test's songs are pending
+    with get_session() as session:
+        session.execute(text("UPDATE song SET download_status = 'failed' WHERE download_status = 'pending'"))
+    sync._ingest_tracks(FakeSpotify.make_tracks(20, start=50_000))
+
+    claim = jobs.claim
+
+    def failing_claim(kind: str, limit: int):
+        if kind == "embed":
+            raise RuntimeError("embed queue unavailable")
+        return claim(kind, limit)
+
+    monkeypatch.setattr(jobs, "claim", failing_claim)
+    monkeypatch.setattr(settings, "pipeline_queue_size", 2)
+    monkeypatch.setattr(download, "_pool", DownloadPool(
+        size=download._limiter.maximum,
+        params={**download._ydl_params, "bench_download_ms": 20},
+        target=fake_ytdlp_worker,
+    ))
+    model_manager.set(StubCLAP())
+
+    async def run():
+        started = await pipeline.start_pipeline()
+        assert started["status"] == "started"
+        # Hung forever before: downloaders waited on a hand-off nobody drained
+        await asyncio.wait_for(pipeline._state["runner"], timeout=30)
+
+    try:
+        asyncio.run(run())
+    finally:
+        download._pool.close()
+
+    assert embed._state["progress"]["status"] == "error: embed queue unavailable"
+    assert download._state["progress"]["status"].startswith("error: stopped because the embed stage ended")
+    assert download._limiter.in_flight == 0
+    assert pipeline._state["status"].startswith("error")
+    assert bus.latest("pipeline").event == "error"
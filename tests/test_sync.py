@@ -0,0 +1,67 @@
+"""Playlist and liked-songs sync against FakeSpotify."""
+import asyncio
+import time
+from datetime import datetime
+
+from sqlmodel import func, select
+
+from backend.database import get_session
+from backend.models import Song
+from backend.routers import sync
+
+LIKED_PATH = "/v1/me/tracks"
+
+
+def _song_count(prefix: str) -> int:
+    with get_session() as session:
+        return session.exec(
+            select(func.count()).select_from(Song).where(Song.spotify_id.startswith(prefix))
+        ).one()
+
+
+def test_unchanged_snapshot_costs_one_call(fake_spotify):
+    fake_spotify.add_playlist("unchanged", fake_spotify.make_tracks(120, start=10_000))
+    asyncio.run(sync._sync_playlist("unchanged"))
+    assert sync._state["progress"]["status"] == "complete"
+    first = sum(fake_spotify.calls.values())
+    assert first > 1
+
+    asyncio.run(sync._sync_playlist("unchanged"))
+    assert sync._state["progress"]["status"] == "complete"
+    assert sum(fake_spotify.calls.values()) - first == 1
+
+
+def test_liked_songs_stop_at_watermark_with_pages_out_of_order(fake_spotify):
+    old = fake_spotify.make_tracks(300, start=20_000, newest=datetime(2024, 1, 1))
+    fake_spotify.liked = old
+    asyncio.run(sync._sync_liked_songs())
+    assert sync._state["progress"]["status"] == "complete"
+    assert _song_count("track02") == 300
+
+    # 120 new likes on top; pages 50-99 and past the watermark answer slowly,
+    # so the page that reaches the watermark (offset 100) lands first
+    new = fake_spotify.make_tracks(120, start=30_000, newest=datetime(2024, 6, 1))
+    fake_spotify.liked = new + old
+    delays = {"50": 0.2, "100": 0.0}
+    fake_spotify.latency = lambda path, params: delays.get(params.get("offset"), 0.5)
+    fake_spotify.calls.clear()
+
+    asyncio.run(sync._sync_liked_songs())
+    assert sync._state["progress"]["status"] == "complete"
+    # Every new track arrived, though page 50 completed after the stop page
+    assert _song_count("track03") == 120
+    # ...and the walk stopped early instead of fetching all 9 pages
+    assert fake_spotify.calls[LIKED_PATH] < 9
+
+
+def test_retry_after_is_honoured(fake_spotify):
+    fake_spotify.add_playlist("throttled", fake_spotify.make_tracks(60, start=40_000))
+    fake_spotify.throttle(0.4)
+
+    started = time.monotonic()
+    asyncio.run(sync._sync_playlist("throttled", full=True))
+    elapsed = time.monotonic() - started
+
+    assert sync._state["progress"]["status"] == "complete"
+    assert elapsed >= 0.4
+    assert _song_count("track04") == 60